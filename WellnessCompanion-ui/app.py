@@ -1,19 +1,38 @@
-from flask import Flask, request, jsonify, render_template
-import ollama
+from flask import Flask, Response, request, jsonify, render_template, g, has_request_context
 import os
+import json
+import re
 import sys
 import subprocess
-import traceback
-from dotenv import load_dotenv
-from flask_cors import CORS
 import logging
-import re
+import time
+import uuid
+import hmac
+import itertools
+import threading
+from fallbacks import FallbackResponses, chat_key, fallback_key, template_reply
+from http_layer import HttpLayer
+from idempotency import IdempotencyStore
+from journal_store import JournalStore
+from log_config import configure_logging, should_sample
+from long_input import condense, context_size_for, estimate_tokens
+from model_cache import ModelListCache, ModelsUnavailable, fetch_ollama_models
+from model_router import ModelRouter
+from postprocess import ReplyStream, chat_greeting, clean_think_tags, combined_greeting, recipient_greeting
+from prompts import analysis_prompts, summary_prompts
+from qos import Overloaded, QoSController
+from rate_limit import QuotaExceeded, TokenBucketLimiter
+from sessions import SessionNotFound, SessionStore
+from settings import (
+    BASE_DIR, JOURNAL_PATH, LONG_INPUT_CHUNK_TOKENS, LONG_INPUT_PARALLELISM, LONG_INPUT_THRESHOLD, MAX_NUM_CTX,
+    MIN_NUM_CTX, MODEL_ROUTES, REPLY_TOKEN_BUDGET
+)
+from shared_state import CounterBuffer, SharedState
+from tracing import RequestProfiler, record_ollama_timings, record_span, span
+from transcription import RecordingNotFound, VoiceTranscriber, load_engine
 
-# Load environment variables
-load_dotenv()
-
-# Set Ollama path for Windows
-OLLAMA_PATH = os.environ.get('OLLAMA_PATH', 'C:\\Users\\qc_de\\AppData\\Local\\Programs\\Ollama\\ollama.exe')
+# Optional path to the Ollama executable (e.g. on Windows) to add to PATH for the dev server
+OLLAMA_PATH = os.environ.get('OLLAMA_PATH', '')
 
 # Default system prompt
 DEFAULT_SYSTEM_PROMPT = """You are a helpful, accurate, and concise assistant. 
@@ -24,36 +43,528 @@ When answering questions:
 - Use bullet points and numbered lists for clarity when appropriate
 - Keep your answers focused and to the point"""
 
-# Set up logging with more detail
-logging.basicConfig(level=logging.DEBUG)
+# How long the /api/models list is served without asking Ollama again,
+# and how long a stale list may be served while it refreshes in the background
+MODELS_CACHE_TTL = float(os.environ.get('MODELS_CACHE_TTL', '30'))
+MODELS_CACHE_STALE_TTL = float(os.environ.get('MODELS_CACHE_STALE_TTL', '600'))
+# How long a failed model listing is remembered, and how long listing may take (seconds)
+MODELS_CACHE_ERROR_TTL = float(os.environ.get('MODELS_CACHE_ERROR_TTL', '5'))
+MODELS_LIST_TIMEOUT = float(os.environ.get('MODELS_LIST_TIMEOUT', '5'))
+
+# Token required by the /api/admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# Where on-demand request profiles are written
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+# Seconds each worker batches counter updates before writing them to the shared state
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+# SQLite file for state shared by all worker processes (metrics, profiler arming)
+STATE_PATH = os.environ.get('STATE_PATH', os.path.join(BASE_DIR, 'state', 'shared_state.db'))
+# Most changes returned per /api/sync page, and most entries accepted per upload
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+SYNC_MAX_UPLOAD = int(os.environ.get('SYNC_MAX_UPLOAD', '500'))
+
+# How long Ollama keeps the model (and its KV cache) loaded between requests, e.g. '30m'
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '')
+
+# Follow-up conversations: idle expiry, total sessions kept, and history limits per session
+SESSION_IDLE_TTL = int(os.environ.get('SESSION_IDLE_TTL', '1800'))
+SESSION_MAX_COUNT = int(os.environ.get('SESSION_MAX_COUNT', '1000'))
+SESSION_MAX_TURNS = int(os.environ.get('SESSION_MAX_TURNS', '10'))
+SESSION_MAX_CHARS = int(os.environ.get('SESSION_MAX_CHARS', '24000'))
+
+# Per-client token budgets for the LLM routes; see rate_limit.py for the RATE_LIMITS format
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1').lower() in ('1', 'true', 'yes')
+RATE_LIMITS = os.environ.get('RATE_LIMITS', '')
+RATE_LIMITED_ROUTES = ('/api/chat', '/api/analyze', '/api/respond', '/api/voice/<recording_id>/finish')
+# Client X-Request-ID values accepted as is; anything else gets a generated id
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+# Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+TRUST_PROXY = os.environ.get('TRUST_PROXY', '').lower() in ('1', 'true', 'yes')
+
+# Voice notes: speech-to-text engine ('whisper', 'fake' or module:Class) and its
+# model, segments transcribed at once per worker, and upload/wait limits
+STT_ENGINE = os.environ.get('STT_ENGINE', 'whisper')
+STT_MODEL = os.environ.get('STT_MODEL', 'base.en')
+STT_DEVICE = os.environ.get('STT_DEVICE', 'cpu')
+STT_COMPUTE_TYPE = os.environ.get('STT_COMPUTE_TYPE', 'int8')
+STT_WORKERS = int(os.environ.get('STT_WORKERS', '2'))
+STT_MAX_CHUNK_BYTES = int(os.environ.get('STT_MAX_CHUNK_BYTES', str(5 * 1024 * 1024)))
+STT_FINISH_TIMEOUT = float(os.environ.get('STT_FINISH_TIMEOUT', '60'))
+VOICE_RECORDING_TTL = int(os.environ.get('VOICE_RECORDING_TTL', '3600'))
+
+# Degraded mode: good real replies kept per (feature, advisor, recipient, emotion,
+# intensity) and client to serve before the canned templates, and for how long (seconds)
+FALLBACK_POOL_SIZE = int(os.environ.get('FALLBACK_POOL_SIZE', '5'))
+FALLBACK_MAX_AGE = int(os.environ.get('FALLBACK_MAX_AGE', str(7 * 86400)))
+
+# Idempotency-Key on the LLM routes: how long results are kept for repeats (seconds),
+# how long a repeat waits for the first request, and when an abandoned claim lapses
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '120'))
+IDEMPOTENCY_LEASE = int(os.environ.get('IDEMPOTENCY_LEASE', '300'))
+
+# Load-adaptive degradation of generations (see qos.py): levels as JSON, the model
+# used at the small-model level, and the in-flight count / p95 latency counted as full load
+QOS_ENABLED = os.environ.get('QOS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+QOS_LEVELS = os.environ.get('QOS_LEVELS', '')
+QOS_SMALL_MODEL = os.environ.get('QOS_SMALL_MODEL', '')
+QOS_QUEUE_TARGET = int(os.environ.get('QOS_QUEUE_TARGET', '4'))
+QOS_LATENCY_TARGET_MS = float(os.environ.get('QOS_LATENCY_TARGET_MS', '30000'))
+QOS_HOLD_SECONDS = float(os.environ.get('QOS_HOLD_SECONDS', '30'))
+
+# Origin allowed to call the API from a browser, and the smallest JSON/text
+# response body (bytes) that is gzip/brotli compressed for clients accepting it
+CORS_ALLOW_ORIGIN = os.environ.get('CORS_ALLOW_ORIGIN', '*')
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+
+# Structured, queue-based logging; see log_config.py for the LOG_* settings
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-# Enable CORS for all routes with comprehensive configuration
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
-
-# Function to clean <think> tags from responses
-def clean_think_tags(text):
-    """Remove <think> tags and their content from LLM responses"""
-    # Remove everything between <think> and </think> tags (including the tags)
-    cleaned_text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
-    # Remove any standalone <think> or </think> tags that might remain
-    cleaned_text = re.sub(r'</?think>', '', cleaned_text)
-    # Trim extra whitespace
-    cleaned_text = cleaned_text.strip()
-    return cleaned_text
+# CORS preflights, CORS headers and compression for every route
+app.wsgi_app = HttpLayer(
+    app.wsgi_app,
+    allow_origin=CORS_ALLOW_ORIGIN,
+    allow_headers=('Content-Type', 'Authorization', 'X-API-Key', 'X-Admin-Token', 'X-Request-ID', 'If-None-Match',
+                   'Idempotency-Key'),
+    allow_methods=('GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'),
+    expose_headers=('X-Request-ID', 'X-RateLimit-Limit', 'X-RateLimit-Remaining', 'X-RateLimit-Reset',
+                    'Retry-After', 'X-Degraded', 'X-Cache', 'ETag', 'Server-Timing', 'Idempotent-Replayed',
+                    'X-QoS-Level'),
+    min_size=COMPRESS_MIN_SIZE
+)
+
+_ollama_client = None
+_ollama_list_client = None
+_ollama_pid = None
+_ollama_lock = threading.Lock()
+
+def get_ollama():
+    """Return this process's Ollama client, importing the library on first use.
+
+    Importing ollama (httpx, pydantic) is the slowest part of start-up, so it
+    is deferred until the first call. The client is created per process so
+    forked workers never share pooled connections.
+    """
+    global _ollama_client, _ollama_list_client, _ollama_pid
+    if _ollama_client is None or _ollama_pid != os.getpid():
+        with _ollama_lock:
+            if _ollama_client is None or _ollama_pid != os.getpid():
+                import ollama
+                _ollama_client = ollama.Client()
+                # Generations can take minutes; listing models should not
+                _ollama_list_client = ollama.Client(timeout=MODELS_LIST_TIMEOUT)
+                _ollama_pid = os.getpid()
+    return _ollama_client
+
+def get_ollama_lister():
+    """This process's Ollama client for listing models, with a short timeout"""
+    get_ollama()
+    return _ollama_list_client or _ollama_client
+
+state = SharedState(STATE_PATH)
+# Request, generation and fallback counts, written to the shared state in batches
+metrics = CounterBuffer(state, interval=METRICS_FLUSH_INTERVAL)
+
+journal = JournalStore(SharedState(JOURNAL_PATH))
+
+model_cache = ModelListCache(
+    lambda: fetch_ollama_models(get_ollama_lister()),
+    ttl=MODELS_CACHE_TTL,
+    stale_ttl=MODELS_CACHE_STALE_TTL,
+    error_ttl=MODELS_CACHE_ERROR_TTL
+)
+
+profiler = RequestProfiler(PROFILE_DIR, state)
+
+router = ModelRouter.from_env(MODEL_ROUTES, fatal_errors=(QuotaExceeded, Overloaded))
+
+rate_limiter = TokenBucketLimiter.from_env(state, RATE_LIMITS) if RATE_LIMIT_ENABLED else None
+
+sessions = SessionStore(
+    state,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_sessions=SESSION_MAX_COUNT,
+    max_turns=SESSION_MAX_TURNS,
+    max_chars=SESSION_MAX_CHARS
+)
+
+def create_stt_engine():
+    if STT_ENGINE == 'whisper':
+        return load_engine('whisper', model=STT_MODEL, device=STT_DEVICE, compute_type=STT_COMPUTE_TYPE)
+    return load_engine(STT_ENGINE)
+
+idempotency = IdempotencyStore(state, ttl=IDEMPOTENCY_TTL, lease=IDEMPOTENCY_LEASE)
+
+fallbacks = FallbackResponses(state, pool_size=FALLBACK_POOL_SIZE, max_age=FALLBACK_MAX_AGE)
+
+voice = VoiceTranscriber(state, create_stt_engine(), workers=STT_WORKERS, recording_ttl=VOICE_RECORDING_TTL)
+
+# Generations currently running in this process; reported while draining on shutdown
+inflight_generations = 0
+_inflight_lock = threading.Lock()
+
+qos = QoSController.from_env(
+    QOS_LEVELS,
+    small_model=QOS_SMALL_MODEL,
+    inflight=lambda: inflight_generations,
+    queue_target=QOS_QUEUE_TARGET,
+    latency_target_ms=QOS_LATENCY_TARGET_MS,
+    hold=QOS_HOLD_SECONDS
+) if QOS_ENABLED else None
+
+def qos_level():
+    """Degradation level the current request was admitted at ({} when not degraded)"""
+    return (g.get('qos') if has_request_context() else None) or {}
+
+def qos_options(options, level=None):
+    """Apply a QoS level (the request's by default) to Ollama options; returns the think setting"""
+    level = qos_level() if level is None else level
+    if level.get('fallback'):
+        mark_degraded('overload')
+        raise Overloaded("Serving fallbacks while the LLM is overloaded")
+    if level.get('num_predict'):
+        options['num_predict'] = level['num_predict']
+    return level.get('think')
+
+def quota_exhausted():
+    """True when the current request is over budget and should not call Ollama"""
+    return has_request_context() and bool(g.get('quota')) and not g.quota['allowed']
+
+def tokens_used(response):
+    return (response.get('prompt_eval_count') or 0) + (response.get('eval_count') or 0)
+
+def ollama_chat(model, messages, options, think=None):
+    """Run one Ollama chat call, tracking in-flight generations, latency and counters"""
+    global inflight_generations
+    with _inflight_lock:
+        inflight_generations += 1
+    started = time.perf_counter()
+    try:
+        response = get_ollama().chat(
+            model=model,
+            messages=messages,
+            options=options,
+            keep_alive=OLLAMA_KEEP_ALIVE or None,
+            **({'think': think} if think is not None else {})
+        )
+    except Exception:
+        metrics.incr('generations:errors')
+        raise
+    finally:
+        with _inflight_lock:
+            inflight_generations -= 1
+    if qos:
+        qos.record_latency((time.perf_counter() - started) * 1000)
+    metrics.incr('generations:total')
+    return response
+
+def ollama_chat_stream(model, messages, options, think=None):
+    """Streaming ollama_chat: yields reply chunks, the last one carrying the token counts"""
+    global inflight_generations
+    with _inflight_lock:
+        inflight_generations += 1
+    started = time.perf_counter()
+    try:
+        for chunk in get_ollama().chat(
+            model=model,
+            messages=messages,
+            options=options,
+            keep_alive=OLLAMA_KEEP_ALIVE or None,
+            stream=True,
+            **({'think': think} if think is not None else {})
+        ):
+            yield chunk
+    except Exception:
+        metrics.incr('generations:errors')
+        raise
+    finally:
+        with _inflight_lock:
+            inflight_generations -= 1
+    if qos:
+        qos.record_latency((time.perf_counter() - started) * 1000)
+    metrics.incr('generations:total')
+
+def start_stream(model, messages, options, think=None):
+    """Open a streamed generation and wait for its first chunk.
+
+    Connection and model errors surface here, before any bytes are sent,
+    so the router can still try the next model.
+    """
+    chunks = ollama_chat_stream(model, messages, options, think)
+    first = next(chunks, None)
+    return itertools.chain([first] if first is not None else [], chunks)
+
+def context_size_for_messages(messages):
+    """num_ctx needed for a message list plus the reply"""
+    prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+    return context_size_for(prompt_tokens, REPLY_TOKEN_BUDGET, MAX_NUM_CTX, MIN_NUM_CTX)
+
+def call_ollama(model, system_prompt, user_message, temperature=0.7):
+    """Send a system + user message to Ollama and return the raw reply text"""
+    messages = [
+        {
+            'role': 'system',
+            'content': system_prompt
+        },
+        {
+            'role': 'user',
+            'content': user_message,
+        }
+    ]
+    return call_ollama_messages(model, messages, temperature)
+
+def call_ollama_messages(model, messages, temperature=0.7, num_ctx=None):
+    """Send a full message list to Ollama and return the raw reply text"""
+    if quota_exhausted():
+        # Over budget with on_exhausted=fallback: callers serve their canned response
+        g.degraded = 'quota'
+        raise QuotaExceeded("Token quota exceeded")
+
+    # Size the context window to the prompt instead of relying on the model
+    # default, which silently truncates long prompts
+    if num_ctx is None:
+        num_ctx = context_size_for_messages(messages)
+
+    options = {
+        'temperature': float(temperature),
+        'num_ctx': num_ctx
+    }
+    think = qos_options(options)
+
+    started = time.perf_counter()
+    response = ollama_chat(model, messages, options, think)
+    record_ollama_timings(response, (time.perf_counter() - started) * 1000)
+    if has_request_context():
+        g.llm_tokens = g.get('llm_tokens', 0) + tokens_used(response)
+    return response['message']['content']
+
+def generate(task, system_prompt, user_message, temperature=0.7):
+    """Call the model routed for ``task``; returns (raw reply text, model used)"""
+    small_model = qos_level().get('model')
+    if small_model:
+        # Under heavy load every routed task goes to the smaller model
+        return call_ollama(small_model, system_prompt, user_message, temperature), small_model
+    return router.call(task, lambda model: call_ollama(model, system_prompt, user_message, temperature))
+
+def summarize_chunk(index, total, chunk, level):
+    """Map step for long entries: summarize one part of a journal entry.
+
+    Runs on a worker thread, so it must not touch the request context;
+    ``level`` is the request's QoS level, read before the threads start.
+    """
+    system_prompt, user_message = summary_prompts(index, total, chunk)
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message)
+    messages = [
+        {
+            'role': 'system',
+            'content': system_prompt
+        },
+        {
+            'role': 'user',
+            'content': user_message,
+        }
+    ]
+    options = {
+        'temperature': 0.3,
+        'num_ctx': context_size_for(prompt_tokens, REPLY_TOKEN_BUDGET, MAX_NUM_CTX, MIN_NUM_CTX)
+    }
+    think = qos_options(options, level)
+    if level.get('model'):
+        response = ollama_chat(level['model'], messages, options, think)
+    else:
+        response, _ = router.call('summary', lambda model: ollama_chat(model, messages, options, think))
+    return clean_think_tags(response['message']['content']), tokens_used(response)
+
+def prepare_entry(content):
+    """Replace a very long entry with per-part summaries; short entries pass through"""
+    level = qos_level()
+    if quota_exhausted() or level.get('fallback'):
+        return content
+    started = time.perf_counter()
+    try:
+        entry_text, chunks, chunk_tokens = condense(
+            content,
+            lambda index, total, chunk: summarize_chunk(index, total, chunk, level),
+            LONG_INPUT_THRESHOLD,
+            LONG_INPUT_CHUNK_TOKENS,
+            LONG_INPUT_PARALLELISM
+        )
+    except Exception as e:
+        logger.warning("Summarizing long entry failed, using it as is: %s", e)
+        return content
+    if chunks:
+        record_span('summarize', started, f"{chunks} chunks")
+        g.llm_tokens = g.get('llm_tokens', 0) + chunk_tokens
+        logger.info("Condensed long journal entry", extra={
+            'entry_tokens': estimate_tokens(content),
+            'chunks': chunks
+        })
+    return entry_text
+
+def client_address():
+    if TRUST_PROXY and request.headers.get('X-Forwarded-For'):
+        return request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return request.remote_addr
+
+def client_identity():
+    """Who is calling: the hashed X-API-Key, else the client address"""
+    api_key = request.headers.get('X-API-Key')
+    return f"key:{TokenBucketLimiter.hash_key(api_key)}" if api_key else f"ip:{client_address()}"
+
+def mark_degraded(reason):
+    g.degraded = f"{g.degraded}, {reason}" if g.get('degraded') else reason
+
+def serve_fallback(key, emotion='', intensity=3, content=''):
+    """Stand-in reply when the LLM failed: a pooled real reply, else the template"""
+    text, source = fallbacks.serve(key, client_identity(), emotion, intensity, content)
+    g.fallback = source
+    mark_degraded(f"fallback-{source}")
+    metrics.incr(f"fallbacks:{source}")
+    return text
+
+def remember_reply(key, text, model):
+    """Offer a real reply to the degraded-mode pool"""
+    try:
+        fallbacks.record(key, client_identity(), text, model)
+    except Exception as e:
+        logger.warning("Could not pool reply: %s", e)
+
+def fallback_fields(result):
+    """Add the degraded-mode source to a JSON result when a fallback was served"""
+    if g.get('fallback'):
+        result['degraded'] = g.fallback
+    return result
+
+@app.before_request
+def before_request():
+    """Assign a request id and decide whether this request's logs are sampled"""
+    # A client's own id is kept only if it is short and safe to echo, log and store
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if REQUEST_ID_PATTERN.fullmatch(request_id) else uuid.uuid4().hex[:16]
+    g.log_sampled = should_sample()
+    g.request_started = time.perf_counter()
+    g.profile = None
+    if not request.path.startswith('/api/admin'):
+        g.profile = profiler.start()
+
+    g.quota = None
+    # Buckets are per route pattern, so every recording shares one voice budget
+    g.route = request.url_rule.rule if request.url_rule else request.path
+
+    if request.method == 'POST' and g.route in RATE_LIMITED_ROUTES and request.headers.get('Idempotency-Key'):
+        # Repeats are answered before the quota check; they cost no tokens
+        response = claim_idempotency_key(request.headers['Idempotency-Key'])
+        if response is not None:
+            return response
+
+    if rate_limiter and request.method == 'POST' and g.route in RATE_LIMITED_ROUTES:
+        g.client_id = rate_limiter.client_id(request.headers.get('X-API-Key'), client_address())
+        g.quota = rate_limiter.check(g.client_id, g.route)
+        if not g.quota['allowed'] and g.quota['on_exhausted'] == 'reject':
+            # Reject before parsing the body or touching Ollama
+            response = jsonify({
+                'error': 'Token quota exceeded',
+                'retry_after': g.quota['retry_after']
+            })
+            response.status_code = 429
+            return response
+
+    if qos and request.method == 'POST' and g.route in RATE_LIMITED_ROUTES:
+        # One level for the whole request, reported in X-QoS-Level
+        g.qos = qos.level()
+
+def claim_idempotency_key(raw_key):
+    """Claim the request's Idempotency-Key, or answer a repeat of it.
+
+    Returns None when this request should generate, otherwise the
+    response to send: the stored result, or an error.
+    """
+    if len(raw_key) > 255:
+        return jsonify({'error': 'Idempotency-Key must be at most 255 characters'}), 400
+    # Keys are scoped to the caller and path, so clients cannot read each other's results
+    # and one voice note's finish cannot replay another's transcript
+    key = f"{client_identity()}:{request.path}:{raw_key}"
+    # JSON bodies are compared by content, so key order and spacing may differ between retries
+    data = request.get_json(silent=True)
+    body = json.dumps(data, sort_keys=True).encode('utf-8') if data is not None else request.get_data()
+    fingerprint = IdempotencyStore.fingerprint(body)
+    with span('idempotency'):
+        outcome, stored = idempotency.wait(key, fingerprint, IDEMPOTENCY_WAIT)
+    if outcome == 'new':
+        g.idempotency_key = key
+        return None
+    if outcome == 'mismatch':
+        return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+    if outcome == 'pending':
+        response = jsonify({'error': 'A request with this Idempotency-Key is still in progress'})
+        response.status_code = 409
+        response.headers['Retry-After'] = '5'
+        return response
+    metrics.incr('idempotency:replayed')
+    response = Response(stored['body'], status=stored['status'], content_type=stored['content_type'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def finish_idempotency_key(response):
+    """Store a claimed key's result, or release the key so a retry generates again.
+
+    Only complete successful answers are kept: errors, streamed replies and
+    fallbacks served while the LLM was unavailable are not replayed.
+    """
+    key = g.pop('idempotency_key', None)
+    if key is None:
+        return
+    if 200 <= response.status_code < 300 and not response.is_streamed and not g.get('fallback'):
+        idempotency.complete(key, response.status_code, response.get_data(), response.content_type)
+    else:
+        idempotency.release(key)
 
 @app.after_request
 def after_request(response):
     """Add headers to every response"""
-    logger.debug("Processing after_request hook")
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-    response.headers.add('Access-Control-Max-Age', '3600')
-    logger.debug(f"Response headers: {dict(response.headers)}")
+    response.headers['X-Request-ID'] = g.request_id
+    finish_idempotency_key(response)
+
+    if g.get('quota'):
+        quota = g.quota
+        if g.get('llm_tokens'):
+            quota = rate_limiter.charge(g.client_id, g.route, g.llm_tokens)
+        response.headers.update(rate_limiter.headers(quota))
+    if g.get('degraded'):
+        response.headers['X-Degraded'] = g.degraded
+    if g.get('qos'):
+        response.headers['X-QoS-Level'] = g.qos['name']
+
+    duration_ms = (time.perf_counter() - g.request_started) * 1000
+    trace = g.get('trace')
+    timings = [trace.server_timing()] if trace and trace.spans else []
+    timings.append(f"total;dur={duration_ms:.1f}")
+    response.headers['Server-Timing'] = ', '.join(timings)
+    response.headers['Timing-Allow-Origin'] = '*'
+
+    if g.get('profile') is not None:
+        profiler.finish(g.profile, request.path)
+
+    if request.endpoint:
+        metrics.incr(f"requests:{request.endpoint}:{response.status_code}")
+
+    logger.info("request completed", extra={
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 1)
+    })
     return response
 
+@app.teardown_request
+def teardown_request(exc):
+    """Release an Idempotency-Key whose request failed before after_request"""
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        idempotency.release(key)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -63,275 +574,468 @@ def test():
     """Simple test route to verify the server is running"""
     return jsonify({"status": "ok", "message": "Test route working"})
 
-@app.route('/api/chat', methods=['POST', 'OPTIONS'])
+@app.route('/api/chat', methods=['POST'])
 def chat():
     """Handle chat requests to the LLM"""
-    if request.method == 'OPTIONS':
-        return handle_preflight()
-        
     try:
-        print(f"Received request to /api/chat: {request.method}")
-        print(f"Request headers: {dict(request.headers)}")
-        
-        data = request.json
-        print(f"Request data: {data}")
+        with span('parse'):
+            data = request.json
         
         user_message = data.get('message', '')
-        model_name = data.get('model', 'deepseek-r1:1.5b')  # Default to smaller model
+        model_name = data.get('model')  # Routed per task unless the client picks one
         system_prompt = data.get('system_prompt', DEFAULT_SYSTEM_PROMPT)
         temperature = data.get('temperature', 0.7)  # Default temperature
+        logger.debug("chat request", extra={'model': model_name, 'user_message': user_message})
         
+        if data.get('session_id'):
+            return session_followup(data['session_id'], data, temperature)
+
+        if data.get('stream'):
+            return stream_chat(data, user_message, model_name, system_prompt, temperature)
+
         try:
-            # Call the DeepSeek model through Ollama
-            response = ollama.chat(
-                model=model_name,
-                messages=[
-                    {
-                        'role': 'system',
-                        'content': system_prompt
-                    },
-                    {
-                        'role': 'user',
-                        'content': user_message,
-                    }
-                ],
-                options={
-                    'temperature': float(temperature)
-                }
-            )
-            
-            response_text = response['message']['content']
-            print(f"LLM response: {response_text[:100]}...")
-            
-            # Clean think tags from response
-            response_text = clean_think_tags(response_text)
+            # Call the requested model, or the one routed for free-form chat
+            if model_name:
+                response_text = call_ollama(model_name, system_prompt, user_message, temperature)
+            else:
+                response_text, model_name = generate('chat', system_prompt, user_message, temperature)
+            logger.debug("LLM response received", extra={'response': response_text})
             
-            # If it seems like the model isn't following our instructions,
-            # we can manually format the response
-            response_text = format_response_if_needed(data, response_text)
+            with span('postprocess'):
+                # Strip reasoning, then add the requested greeting if the
+                # model didn't follow the format
+                response_text = chat_greeting(user_message, clean_think_tags(response_text))
             
-            return jsonify({
-                'response': response_text,
-                'model': model_name
-            })
+            with span('serialize'):
+                return jsonify({
+                    'response': response_text,
+                    'model': model_name
+                })
         except Exception as e:
-            print(f"Error calling Ollama: {str(e)}")
-            print(traceback.format_exc())
+            logger.warning("Error calling Ollama: %s", e, exc_info=True)
             
-            # Provide hardcoded responses when Ollama fails
-            fallback_response = get_fallback_response(data)
-            return jsonify({
-                'response': fallback_response,
+            return jsonify(fallback_fields({
+                'response': serve_fallback(chat_key(user_message)),
                 'model': "fallback"
-            })
+            }))
     except Exception as e:
-        print(f"Error in /api/chat: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in /api/chat: %s", e)
         return jsonify({'error': str(e)}), 500
 
-def format_response_if_needed(data, response_text):
-    """Format the response if the model didn't follow instructions"""
-    message = data.get('message', '')
-    
-    # Only apply formatting if the response is completely missing the required format
-    # Check if this is an advisor perspective request
-    if "advisorPerspective" in message or "therapist" in message or "friend" in message or "mentor" in message or "parent" in message:
-        for advisor in ["therapist", "friend", "mentor", "parent"]:
-            if advisor in message.lower():
-                # Only format if the response is completely missing the required identifier
-                if advisor == "therapist" and not any(phrase in response_text.lower() for phrase in ["as your therapist", "from a therapeutic perspective", "as a therapist"]):
-                    print(f"Adding therapist prefix to response: {response_text[:50]}...")
-                    return f"As your therapist, I want to acknowledge your feelings. {response_text}"
-                elif advisor == "friend" and not any(phrase in response_text.lower() for phrase in ["as your friend", "hey", "hi friend"]):
-                    print(f"Adding friend prefix to response: {response_text[:50]}...")
-                    return f"Hey there, as your friend, I just want to say I'm here for you. {response_text}"
-                elif advisor == "mentor" and not any(phrase in response_text.lower() for phrase in ["as your mentor", "from a mentorship perspective"]):
-                    print(f"Adding mentor prefix to response: {response_text[:50]}...")
-                    return f"As your mentor, I see this as a growth opportunity. {response_text}"
-                elif advisor == "parent" and not any(phrase in response_text.lower() for phrase in ["as your parent", "my dear"]):
-                    print(f"Adding parent prefix to response: {response_text[:50]}...")
-                    return f"My dear, as your parent, I want you to know I care. {response_text}"
-    
-    # Check if this is a recipient formatting request
-    if "recipient" in message or "sharing with" in message:
-        for recipient in ["self", "friend", "partner", "family"]:
-            if recipient in message.lower():
-                # Only format if the response is completely missing the required format
-                if recipient == "self" and not any(phrase in response_text for phrase in ["Personal reflection", "Note to self"]):
-                    print(f"Adding self-reflection format to response: {response_text[:50]}...")
-                    return f"Personal reflection: {response_text}"
-                elif recipient == "friend" and not any(phrase in response_text for phrase in ["Dear friend", "Hey friend"]):
-                    print(f"Adding friend format to response: {response_text[:50]}...")
-                    return f"Dear friend, {response_text}"
-                elif recipient == "partner" and not any(phrase in response_text for phrase in ["Dear partner", "My love"]):
-                    print(f"Adding partner format to response: {response_text[:50]}...")
-                    return f"Dear partner, {response_text}"
-                elif recipient == "family" and not any(phrase in response_text for phrase in ["Dear family", "To my family"]):
-                    print(f"Adding family format to response: {response_text[:50]}...")
-                    return f"Dear family, {response_text}"
-    
-    # Otherwise, leave the response as is
-    return response_text
+def stream_chat(data, user_message, model_name, system_prompt, temperature):
+    """Stream a chat reply as NDJSON {"delta"} lines, then one {"done"} line with the full reply.
 
-def get_fallback_response(data):
-    """Generate fallback responses when the LLM fails"""
-    message = data.get('message', '')
-    
-    # Advisor perspective fallbacks
-    if "therapist" in message.lower():
-        return "As your therapist, I want to acknowledge that it's completely normal to feel this way. Your emotions are valid and provide important information about what matters to you. What specific aspects of this situation feel most challenging right now? Remember that developing small coping strategies can make a significant difference."
-    
-    if "friend" in message.lower():
-        return "Hey there, as your friend, I just want to say I'm totally here for you! We all go through tough times, and you're handling this like a champ. Want to grab coffee soon and talk more about it? I bet we could brainstorm some fun distractions if you need a break from everything."
-    
-    if "mentor" in message.lower():
-        return "As your mentor, I believe this experience offers valuable growth opportunities. Consider how this challenge connects to your longer-term goals. What skills are you developing through this situation that will serve you well in the future? Remember that discomfort often precedes significant development."
-    
-    if "parent" in message.lower():
-        return "My dear, as your parent, I want you to know I'm always here for you. You have shown such strength in difficult situations before, and I have complete faith in your ability to navigate this too. What small step could you take today that might make things a little easier?"
-    
-    # Recipient formatting fallbacks
-    if "sharing with" in message.lower() and "self" in message.lower():
-        return "Personal reflection: I've been experiencing some challenging emotions lately. I'm noticing patterns in how I respond to stress, and I'm working on developing healthier coping strategies. I'm proud of myself for taking time to process these feelings."
-    
-    if "sharing with" in message.lower() and "friend" in message.lower():
-        return "Dear friend, I wanted to share something I've been going through lately. I've had some ups and downs with my emotions, and I'd value your perspective when you have time. No pressure for advice - sometimes just talking helps. Let me know if you'd be up for coffee soon?"
-    
-    if "sharing with" in message.lower() and "partner" in message.lower():
-        return "Dear partner, I've been reflecting on my emotional state lately and wanted to open up to you about it. You're such an important part of my support system, and sharing these feelings with you helps me process them. I appreciate your patience and understanding."
-    
-    if "sharing with" in message.lower() and "family" in message.lower():
-        return "Dear family, I wanted to share some thoughts I've been having lately. Family support means so much to me, and I value the perspective you all bring. I'm working through some emotions and thought it might help to express them to people who know me well."
-    
-    # Default fallback
-    return "Thank you for sharing your thoughts and feelings. I appreciate your openness and trust. Is there a specific aspect of this situation you'd like to explore further?"
-
-def handle_preflight():
-    """Handle CORS preflight requests"""
-    logger.debug("Handling preflight request")
-    logger.debug(f"Preflight request headers: {dict(request.headers)}")
-    response = jsonify({'status': 'ok'})
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-    response.headers.add('Access-Control-Max-Age', '3600')
-    logger.debug(f"Preflight response headers: {dict(response.headers)}")
-    return response
+    Reasoning is stripped and the greeting fixed up as the tokens arrive
+    (see postprocess.ReplyStream). If no model can start generating, the
+    usual non-streamed fallback JSON is returned instead.
+    """
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_message}
+    ]
+    options = {'temperature': float(temperature), 'num_ctx': context_size_for_messages(messages)}
+    try:
+        if quota_exhausted():
+            g.degraded = 'quota'
+            raise QuotaExceeded("Token quota exceeded")
+        think = qos_options(options)
+        model_name = model_name or qos_level().get('model')
+        if model_name:
+            chunks = start_stream(model_name, messages, options, think)
+        else:
+            # Router latency here is the time to the first token
+            chunks, model_name = router.call('chat', lambda model: start_stream(model, messages, options, think))
+    except Exception as e:
+        logger.warning("Error starting Ollama stream: %s", e)
+        return jsonify(fallback_fields({
+            'response': serve_fallback(chat_key(user_message)),
+            'model': "fallback"
+        }))
+
+    reply = ReplyStream(format_head=lambda head: chat_greeting(user_message, head))
+    # The request context is gone while the body streams
+    quota, client_id, route = g.quota, g.get('client_id'), g.route
+
+    def line(payload):
+        return json.dumps(payload, separators=(',', ':')) + '\n'
+
+    def stream():
+        tokens = 0
+        error = None
+        try:
+            for chunk in chunks:
+                delta = reply.feed(chunk['message']['content'] or '')
+                if delta:
+                    yield line({'delta': delta})
+                if chunk.get('done'):
+                    tokens = tokens_used(chunk)
+        except Exception as e:
+            logger.warning("Ollama stream failed: %s", e)
+            error = str(e)
+        delta = reply.finish()
+        if delta:
+            yield line({'delta': delta})
+        if quota and tokens:
+            rate_limiter.charge(client_id, route, tokens)
+        done = {'done': True, 'model': model_name, 'response': reply.text}
+        if error:
+            done['error'] = error
+            if not reply.text:
+                # Failed before anything visible was sent
+                done['response'], done['model'] = template_reply(chat_key(user_message)), "fallback"
+                done['degraded'] = 'template'
+                yield line({'delta': done['response']})
+        yield line(done)
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+def session_followup(session_id, data, temperature):
+    """Answer a follow-up message within a stored conversation"""
+    try:
+        session = sessions.get(session_id)
+    except SessionNotFound:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+
+    user_turn = {'role': 'user', 'content': data.get('message', '')}
+    messages = session['messages'] + [user_turn]
+    # Keep num_ctx stable so Ollama can reuse the cached prefix; only grow it
+    num_ctx = max(session['num_ctx'], context_size_for_messages(messages))
+
+    try:
+        response_text = call_ollama_messages(session['model'], messages, temperature, num_ctx)
+    except Exception as e:
+        logger.warning("Error calling Ollama for session follow-up: %s", e)
+        return jsonify(fallback_fields({
+            'response': serve_fallback(chat_key(user_turn['content'])),
+            'model': "fallback",
+            'session_id': session_id
+        }))
+
+    with span('postprocess'):
+        response_text = clean_think_tags(response_text)
+    try:
+        session = sessions.append(session_id, [user_turn, {'role': 'assistant', 'content': response_text}], num_ctx)
+    except SessionNotFound:
+        # Expired while generating; still return the answer
+        pass
+
+    with span('serialize'):
+        return jsonify({
+            'response': response_text,
+            'model': session['model'],
+            'session_id': session_id,
+            'turns': sum(1 for message in session['messages'] if message['role'] == 'user')
+        })
+
+def session_summary(session):
+    return {
+        'session_id': session['id'],
+        'model': session['model'],
+        'messages': [message for message in session['messages'] if message['role'] != 'system'],
+        'expires_in': SESSION_IDLE_TTL
+    }
+
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """Start a follow-up conversation, optionally seeded with earlier turns"""
+    data = request.get_json(silent=True) or {}
+    history = data.get('messages', [])
+    if not isinstance(history, list) or any(
+        not isinstance(message, dict)
+        or message.get('role') not in ('user', 'assistant')
+        or not isinstance(message.get('content'), str)
+        for message in history
+    ):
+        return jsonify({'error': "messages must be a list of {role: 'user'|'assistant', content}"}), 400
+
+    messages = [{'role': 'system', 'content': data.get('system_prompt', DEFAULT_SYSTEM_PROMPT)}]
+    messages += [{'role': message['role'], 'content': message['content']} for message in history]
+    session = sessions.create(
+        data.get('model') or router.primary('chat'),
+        messages,
+        context_size_for_messages(messages)
+    )
+    return jsonify(session_summary(session)), 201
 
-@app.route('/api/models', methods=['GET', 'OPTIONS'])
+@app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+def session_detail(session_id):
+    """Read or end a follow-up conversation"""
+    if request.method == 'DELETE':
+        sessions.delete(session_id)
+        return jsonify({'status': 'deleted'})
+    try:
+        return jsonify(session_summary(sessions.get(session_id)))
+    except SessionNotFound:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+
+@app.route('/api/models', methods=['GET'])
 def list_models():
     """List available models from Ollama"""
-    if request.method == 'OPTIONS':
-        return handle_preflight()
-        
     try:
-        print("Received request to /api/models")
         try:
-            models = ollama.list()
-            available_models = [model for model in models['models']]
-            print(f"Available models: {available_models}")
-            return jsonify(available_models)
-        except Exception as model_error:
-            print(f"Error listing models: {str(model_error)}")
-            # Return some default models when Ollama fails
-            return jsonify([
-                {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo"},
-                {"id": "gpt-4", "name": "GPT-4"}
-            ])
+            models, etag, fresh = model_cache.get()
+        except ModelsUnavailable as model_error:
+            logger.warning("Error listing models: %s", model_error)
+            # Don't pretend we have models when Ollama can't be reached
+            return jsonify({
+                'error': 'Ollama is unavailable',
+                'detail': str(model_error)
+            }), 503
+
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = jsonify(models)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'private, max-age={int(MODELS_CACHE_TTL)}'
+        response.headers['X-Cache'] = 'fresh' if fresh else 'stale'
+        return response
     except Exception as e:
-        print(f"Error in /api/models: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in /api/models: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/analyze', methods=['POST', 'OPTIONS'])
+def is_admin_request():
+    """Check the admin token sent as a bearer token or X-Admin-Token header"""
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Admin-Token', '')
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        token = auth[len('Bearer '):]
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """Profile the next N requests and dump the results to PROFILE_DIR"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled; set ADMIN_TOKEN to enable them'}), 404
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            profiler.arm(
+                data.get('requests', 1),
+                mode=data.get('mode', 'cprofile'),
+                interval=data.get('interval', 0.005)
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        logger.info("Request profiler armed", extra=profiler.status())
+    return jsonify(profiler.status())
+
+@app.route('/api/admin/metrics', methods=['GET'])
+def admin_metrics():
+    """Counters aggregated across all worker processes"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403 if ADMIN_TOKEN else 404
+    # Other workers' latest counts arrive with their next flush
+    metrics.flush()
+    return jsonify({
+        'counters': state.counters(),
+        'models': router.status(),
+        'fallback_pool': fallbacks.stats(),
+        'qos': qos.status() if qos else None,
+        'worker': {'pid': os.getpid(), 'inflight_generations': inflight_generations}
+    })
+
+def sync_user():
+    """Owner of the journal being synced: the hashed X-API-Key"""
+    api_key = request.headers.get('X-API-Key')
+    return TokenBucketLimiter.hash_key(api_key) if api_key else None
+
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """Entries saved or deleted since a cursor, as JSON pages or one NDJSON stream"""
+    user_id = sync_user()
+    if not user_id:
+        return jsonify({'error': 'Syncing needs an X-API-Key header'}), 401
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = max(1, min(int(request.args.get('limit', SYNC_PAGE_SIZE)), SYNC_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'cursor and limit must be integers'}), 400
+
+    if cursor > journal.latest_cursor(user_id):
+        # The server's journal was reset; the device has to sync from scratch
+        return jsonify({'error': 'Cursor is ahead of the server; sync again from cursor 0'}), 410
+
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        def stream(cursor):
+            while True:
+                changes, more = journal.changes_since(user_id, cursor, SYNC_PAGE_SIZE)
+                for change in changes:
+                    yield json.dumps(change, separators=(',', ':')) + '\n'
+                if changes:
+                    cursor = changes[-1]['cursor']
+                if not more:
+                    break
+            yield json.dumps({'cursor': cursor, 'has_more': False}, separators=(',', ':')) + '\n'
+        return Response(stream(cursor), mimetype='application/x-ndjson')
+
+    with span('query'):
+        changes, more = journal.changes_since(user_id, cursor, limit)
+    with span('serialize'):
+        return jsonify({
+            'changes': changes,
+            'cursor': changes[-1]['cursor'] if changes else cursor,
+            'has_more': more
+        })
+
+@app.route('/api/sync/entries', methods=['POST'])
+def upload_entries():
+    """Save entries written (or deleted) offline, all in one transaction"""
+    user_id = sync_user()
+    if not user_id:
+        return jsonify({'error': 'Syncing needs an X-API-Key header'}), 401
+
+    with span('parse'):
+        data = request.get_json(silent=True) or {}
+    entries = data.get('entries', [])
+    deleted = data.get('deleted', [])
+    if not isinstance(entries, list) or any(
+        not isinstance(entry, dict) or not isinstance(entry.get('id'), str) or not entry['id']
+        for entry in entries
+    ):
+        return jsonify({'error': 'entries must be a list of journal entries with string ids'}), 400
+    if not isinstance(deleted, list) or any(not isinstance(entry_id, str) for entry_id in deleted):
+        return jsonify({'error': 'deleted must be a list of entry ids'}), 400
+    if len(entries) + len(deleted) > SYNC_MAX_UPLOAD:
+        return jsonify({'error': f'At most {SYNC_MAX_UPLOAD} entries and deletions per upload'}), 413
+
+    try:
+        with span('write', f"{len(entries)} entries"):
+            result = journal.save_entries(user_id, entries, deleted)
+    except Exception as e:
+        logger.exception("Error in /api/sync/entries: %s", e)
+        return jsonify({'error': str(e)}), 500
+    return jsonify(result)
+
+def analyze_entry(content, emotion, intensity):
+    """Analyze a journal entry with the LLM, falling back to a pooled or canned reply.
+
+    Returns (analysis, model), with model 'fallback' when the LLM failed.
+    """
+    # Very long entries are summarized in parts first
+    entry_text = prepare_entry(content)
+    
+    prompt_started = time.perf_counter()
+    # Create the appropriate prompts
+    system_prompt, user_message = analysis_prompts(entry_text, emotion, intensity)
+    
+    record_span('prompt', prompt_started)
+    
+    # Get response from chat endpoint
+    try:
+        analysis, model = generate('analysis', system_prompt, user_message)
+        
+        # Clean think tags from analysis
+        with span('postprocess'):
+            analysis = clean_think_tags(analysis)
+        
+        remember_reply(fallback_key('analysis', emotion=emotion, intensity=intensity), analysis, model)
+        return analysis, model
+    except Exception as e:
+        logger.warning("Error getting analysis from LLM: %s", e)
+        # A recent real analysis for the same emotion, else the canned one
+        analysis = serve_fallback(fallback_key('analysis', emotion=emotion, intensity=intensity), emotion, intensity)
+    
+    return analysis, 'fallback'
+
+@app.route('/api/analyze', methods=['POST'])
 def analyze():
     """Compatibility route for older API - redirects to /api/chat"""
-    if request.method == 'OPTIONS':
-        return handle_preflight()
-    
     try:
-        data = request.json
+        with span('parse'):
+            data = request.json
         content = data.get('content', '')
         emotion = data.get('emotion', '')
         intensity = data.get('intensity', 3)
         
-        # Create the appropriate prompts
-        system_prompt = f"""You are an empathetic and insightful AI assistant analyzing a journal entry.
-Your task is to provide a thoughtful analysis of the writer's emotions and thoughts.
-The journal entry is about feeling {emotion} with intensity level {intensity} (on a scale of 1-5).
-Focus on providing validation, insight, and gentle observations about patterns in the text.
-Keep your response to 3-4 sentences, written in second person (addressing the writer directly)."""
+        analysis, model = analyze_entry(content, emotion, intensity)
+        
+        with span('serialize'):
+            return jsonify(fallback_fields({"analysis": analysis, "model": model}))
+    except Exception as e:
+        logger.exception("Error in /api/analyze: %s", e)
+        return jsonify({'error': str(e)}), 500
 
-        user_message = f"""The user has written a journal entry about feeling {emotion} with intensity level {intensity} (on a scale of 1-5). 
-Here's their entry: "{content}"
+@app.route('/api/voice', methods=['POST'])
+def start_voice_note():
+    """Open a voice-note recording that audio chunks are uploaded to"""
+    recording_id = voice.start()
+    return jsonify({
+        'recording_id': recording_id,
+        'max_chunk_bytes': STT_MAX_CHUNK_BYTES,
+        'expires_in': VOICE_RECORDING_TTL
+    }), 201
 
-Provide an empathetic and insightful analysis of their emotions and thoughts. Focus on validation, insight, and gentle observations."""
-        
-        # Redirect to chat endpoint
-        chat_data = {
-            'message': user_message,
-            'system_prompt': system_prompt,
-            'model': 'deepseek-r1:1.5b',
-            'temperature': 0.7
-        }
-        
-        # Get response from chat endpoint
+@app.route('/api/voice/<recording_id>/chunks/<int:seq>', methods=['PUT', 'POST'])
+def upload_voice_chunk(recording_id, seq):
+    """Receive one recorded segment (raw audio body) and transcribe it in the background"""
+    if request.content_length and request.content_length > STT_MAX_CHUNK_BYTES:
+        return jsonify({'error': f'Chunks are limited to {STT_MAX_CHUNK_BYTES} bytes'}), 413
+    audio = request.get_data(cache=False)
+    if not audio:
+        return jsonify({'error': 'Empty audio chunk'}), 400
+    if len(audio) > STT_MAX_CHUNK_BYTES:
+        return jsonify({'error': f'Chunks are limited to {STT_MAX_CHUNK_BYTES} bytes'}), 413
+    try:
+        voice.add_chunk(recording_id, seq, audio, request.mimetype)
+    except RecordingNotFound:
+        return jsonify({'error': 'Unknown, finished or expired recording'}), 404
+    return jsonify({'recording_id': recording_id, 'seq': seq, 'status': 'queued'}), 202
+
+@app.route('/api/voice/<recording_id>', methods=['GET'])
+def voice_note_progress(recording_id):
+    """Transcript of the segments transcribed so far"""
+    try:
+        return jsonify(voice.progress(recording_id))
+    except RecordingNotFound:
+        return jsonify({'error': 'Unknown, finished or expired recording'}), 404
+
+@app.route('/api/voice/<recording_id>/finish', methods=['POST'])
+def finish_voice_note(recording_id):
+    """Assemble the transcript once recording stops and analyze it like a typed entry"""
+    try:
+        with span('parse'):
+            data = request.get_json(silent=True) or {}
+        emotion = data.get('emotion', '')
+        intensity = data.get('intensity', 3)
+        chunks = data.get('chunks')
+        if chunks is not None and (not isinstance(chunks, int) or isinstance(chunks, bool) or chunks < 0):
+            return jsonify({'error': 'chunks must be a non-negative integer'}), 400
+
+        started = time.perf_counter()
         try:
-            response = ollama.chat(
-                model='deepseek-r1:1.5b',
-                messages=[
-                    {
-                        'role': 'system',
-                        'content': system_prompt
-                    },
-                    {
-                        'role': 'user',
-                        'content': user_message,
-                    }
-                ],
-                options={
-                    'temperature': 0.7
-                }
-            )
-            
-            analysis = response['message']['content']
-            
-            # Clean think tags from analysis
-            analysis = clean_think_tags(analysis)
-            
-            return jsonify({"analysis": analysis})
-        except Exception as e:
-            print(f"Error getting analysis from LLM: {str(e)}")
-            # Fallback analysis based on emotion
-            if emotion.lower() == 'happy':
-                analysis = f"I sense that you're feeling {emotion} with {intensity} intensity. Your journal entry shows genuine joy and a positive outlook. This happiness seems to stem from recent achievements or connections in your life. Savor these positive emotions and consider what contributed to them."
-            elif emotion.lower() == 'sad':
-                analysis = f"I notice a sense of {emotion}ness with {intensity} intensity in your writing. Your journal reflects some difficult emotions that you're processing thoughtfully. This sadness appears connected to meaningful aspects of your life, showing what you value. Be gentle with yourself as you navigate these feelings."
-            elif emotion.lower() == 'angry':
-                analysis = f"Your writing shows {emotion} feelings with {intensity} intensity. This emotion often signals boundaries being crossed or needs not being met. Your awareness of these feelings is a strength and indicates self-awareness. Consider what specific needs might be underlying this emotional response."
-            elif emotion.lower() == 'anxious':
-                analysis = f"I sense {emotion}ness with {intensity} intensity in your journal entry. Your thoughtful reflection shows you're engaging with these feelings rather than avoiding them. This anxiety may be highlighting areas where you care deeply or feel uncertainty. Small steps toward addressing specific concerns could be helpful."
-            else:
-                analysis = f"I sense that you're feeling {emotion} with {intensity} intensity. Your journal entry shows self-awareness and a desire to understand these emotions better. Reflecting on your feelings this way is a helpful practice for emotional well-being."
-        
-        return jsonify({"analysis": analysis})
+            result = voice.finish(recording_id, chunks, STT_FINISH_TIMEOUT)
+        except RecordingNotFound:
+            return jsonify({'error': 'Unknown, finished or expired recording'}), 404
+        record_span('transcribe', started, f"{result['segments']} segments")
+        if not result['complete']:
+            mark_degraded('partial-transcript')
+            logger.warning("Voice note finished with segments still pending", extra={
+                'recording_id': recording_id,
+                'segments': result['segments']
+            })
+        if not result['transcript']:
+            return jsonify(dict(result, error='Nothing could be transcribed')), 422
+
+        result['analysis'], result['model'] = analyze_entry(result['transcript'], emotion, intensity)
+
+        with span('serialize'):
+            return jsonify(fallback_fields(result))
     except Exception as e:
-        print(f"Error in /api/analyze: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in /api/voice/finish: %s", e)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/respond', methods=['POST', 'OPTIONS'])
+@app.route('/api/respond', methods=['POST'])
 def respond():
     """Compatibility route for older API - redirects to /api/chat"""
-    logger.info(f"Received {request.method} request to /api/respond")
-    logger.debug(f"Request headers: {dict(request.headers)}")
-    
-    if request.method == 'OPTIONS':
-        return handle_preflight()
-    
     try:
-        data = request.json
-        logger.debug(f"Request data: {data}")
+        with span('parse'):
+            data = request.json
         
         content = data.get('content', '')
         emotion = data.get('emotion', '')
@@ -339,14 +1043,27 @@ def respond():
         recipient = data.get('recipient', '')
         intensity = data.get('intensity', 3)
         
-        logger.info(f"POST /api/respond - Content: {content[:50]}... | Emotion: {emotion} | Advisor: {advisor} | Recipient: {recipient} | Intensity: {intensity}")
+        logger.info("respond request", extra={
+            'content': content,
+            'emotion': emotion,
+            'advisor': advisor,
+            'recipient': recipient,
+            'intensity': intensity
+        })
         
         response_text = ""
+        # Model that produced the response; stays 'fallback' for canned text
+        model_used = 'fallback'
+        # Prompts of a successful LLM call, used to start a follow-up session
+        session_seed = None
+        # Very long entries are summarized in parts first
+        entry_text = prepare_entry(content) if advisor or recipient else content
+        prompt_started = time.perf_counter()
         
         # Determine which feature is being used
         if advisor and not recipient:
             # Feature 1: Get advice from a perspective
-            print(f"Generating advisor response from {advisor} perspective")
+            logger.debug("Generating advisor response from %s perspective", advisor)
             
             # Create appropriate prompts based on advisor
             if advisor == 'therapist':
@@ -427,55 +1144,32 @@ IMPORTANT: You MUST follow the exact format below (this is critical!):
 Example: "As someone who cares about you, I want to say I understand your [emotion] feelings. It's completely natural to feel this way. What might help is [brief suggestion]. I'm here for you."
 """
             
-            user_message = f"""The person has written this journal entry about feeling {emotion}: "{content}"
+            user_message = f"""The person has written this journal entry about feeling {emotion}: "{entry_text}"
 They're feeling {emotion} with intensity level {intensity} (on a scale of 1-5).
 Respond to them as a {advisor}, offering support, insight, and guidance appropriate to your role.
 Keep your response to 3-5 sentences.
 Remember to start your response with the specific greeting that identifies you as a {advisor}."""
             
+            record_span('prompt', prompt_started)
             try:
                 # Get response from LLM
-                print(f"Sending request to Ollama with user message: {user_message[:100]}...")
-                response = ollama.chat(
-                    model='deepseek-r1:1.5b',
-                    messages=[
-                        {
-                            'role': 'system',
-                            'content': system_prompt
-                        },
-                        {
-                            'role': 'user',
-                            'content': user_message,
-                        }
-                    ],
-                    options={
-                        'temperature': 0.7
-                    }
-                )
-                
-                response_text = response['message']['content']
-                print(f"Raw Ollama response: {response_text[:100]}...")
+                response_text, model_used = generate(f'advisor:{advisor}', system_prompt, user_message)
+                session_seed = (system_prompt, user_message)
+                logger.debug("Raw Ollama response", extra={'response': response_text})
                 
                 # Clean think tags from response
-                response_text = clean_think_tags(response_text)
+                with span('postprocess'):
+                    response_text = clean_think_tags(response_text)
+                remember_reply(fallback_key('advisor', advisor, '', emotion, intensity), response_text, model_used)
             
             except Exception as e:
-                print(f"Error getting advisor response from LLM: {str(e)}")
+                logger.warning("Error getting advisor response from LLM: %s", e)
                 # Only use fallbacks if Ollama truly fails
-                if advisor == 'therapist':
-                    response_text = f"As your therapist, I want to acknowledge that your feelings of {emotion} are completely valid. Emotions often provide valuable information about what matters to us and what we need. What aspects of this situation feel most significant to you right now? Remember that developing small coping strategies can make a meaningful difference."
-                elif advisor == 'friend':
-                    response_text = f"Hey there, as your friend, I just want to say I totally get why you're feeling {emotion}! That's a lot to deal with, but I've seen you handle tough stuff before. Want to grab coffee soon and talk more about it? I'm always here for you, no matter what."
-                elif advisor == 'mentor':
-                    response_text = f"As your mentor, I believe your {emotion} feelings highlight an important growth opportunity. Consider how this challenge connects to your broader goals and values. What skills might you develop by navigating this situation thoughtfully? Remember that discomfort often precedes significant development."
-                elif advisor == 'parent':
-                    response_text = f"My dear, as your parent, I want you to know that your {emotion} feelings are completely understandable. You've always had such strength in facing challenges, and I have complete faith in you now. What small step might help you feel more grounded today? I'm always here for you, no matter what."
-                else:
-                    response_text = f"As someone who cares about you, I want to say I understand your {emotion} feelings. It's perfectly natural to feel this way given what you're experiencing. What support would be most helpful right now? I'm here for you however you need."
+                response_text = serve_fallback(fallback_key('advisor', advisor, '', emotion, intensity), emotion, intensity)
         
         elif recipient and not advisor:
             # Feature 2: Format for sharing with a recipient
-            print(f"Formatting content for sharing with {recipient}")
+            logger.debug("Formatting content for sharing with %s", recipient)
             
             system_prompt = """You are an AI assistant that helps reformat journal entries for sharing with specific recipients.
 Your task is to paraphrase the content in a way that's appropriate for sharing with the specified recipient.
@@ -496,69 +1190,32 @@ Example for 'friend': "Dear friend, I wanted to share something with you. I've b
 Example for 'self': "Personal reflection: I've been feeling [emotion] with intensity level [#]. [content]. I need to remember this moment and what I've learned from it."
 """
 
-            user_message = f"""I've written this journal entry: "{content}"
+            user_message = f"""I've written this journal entry: "{entry_text}"
 I'm feeling {emotion} with intensity level {intensity} (on a scale of 1-5).
 Please reformat this for sharing with my {recipient}. 
 Don't add any analysis or advice - just paraphrase my content in a way that would be appropriate to share with this person.
 Make sure to start with a greeting that makes it clear this is for my {recipient}."""
             
+            record_span('prompt', prompt_started)
             try:
                 # Get response from LLM
-                print(f"Sending request to Ollama with user message: {user_message[:100]}...")
-                response = ollama.chat(
-                    model='deepseek-r1:1.5b',
-                    messages=[
-                        {
-                            'role': 'system',
-                            'content': system_prompt
-                        },
-                        {
-                            'role': 'user',
-                            'content': user_message,
-                        }
-                    ],
-                    options={
-                        'temperature': 0.7
-                    }
-                )
-                
-                response_text = response['message']['content']
-                print(f"Raw Ollama response for recipient: {response_text[:100]}...")
-                
-                # Clean think tags from response
-                response_text = clean_think_tags(response_text)
+                response_text, model_used = generate('recipient', system_prompt, user_message)
+                session_seed = (system_prompt, user_message)
+                logger.debug("Raw Ollama response for recipient", extra={'response': response_text})
                 
-                # Only use minimal formatting if the response clearly failed to follow instructions
-                if recipient == 'self' and not any(phrase in response_text for phrase in ["Personal reflection", "Note to self", "Dear self"]):
-                    print("Response missing self-reflection format, applying minimal formatting")
-                    response_text = f"Personal reflection: {response_text}"
-                elif recipient == 'friend' and not any(phrase in response_text.lower() for phrase in ["dear friend", "hey friend", "hi friend"]):
-                    print("Response missing friend greeting format, applying minimal formatting")
-                    response_text = f"Dear friend, {response_text}"
-                elif recipient == 'partner' and not any(phrase in response_text.lower() for phrase in ["dear partner", "my love", "honey"]):
-                    print("Response missing partner greeting format, applying minimal formatting")
-                    response_text = f"Dear partner, {response_text}"
-                elif recipient == 'family' and not any(phrase in response_text.lower() for phrase in ["dear family", "to my family"]):
-                    print("Response missing family greeting format, applying minimal formatting")
-                    response_text = f"Dear family, {response_text}"
+                # Strip reasoning and add the greeting only if the response
+                # clearly failed to follow instructions
+                with span('postprocess'):
+                    response_text = recipient_greeting(clean_think_tags(response_text), recipient)
             
             except Exception as e:
-                print(f"Error getting sharing format from LLM: {str(e)}")
+                logger.warning("Error getting sharing format from LLM: %s", e)
                 # Only use fallbacks if Ollama truly fails
-                if recipient == 'self':
-                    response_text = f"Personal reflection: I've been feeling {emotion} with intensity level {intensity}.\n\n{content}\n\nI need to remember this moment and what I've learned from it."
-                elif recipient == 'friend':
-                    response_text = f"Dear friend, I wanted to share something with you. I've been feeling {emotion} with intensity level {intensity} because: {content}\n\nI'd value your thoughts on this if you have time to talk."
-                elif recipient == 'partner':
-                    response_text = f"Dear partner, I wanted to open up to you about something I've been feeling. I've experienced {emotion} with intensity level {intensity} recently: {content}\n\nI'm sharing this because you're important to me and I value our connection."
-                elif recipient == 'family':
-                    response_text = f"Dear family, I wanted to share with you that I've been feeling {emotion} with intensity level {intensity} lately: {content}\n\nI'm sharing this with you because family support means a lot to me."
-                else:
-                    response_text = f"Dear {recipient}, I've been feeling {emotion} with intensity level {intensity} because: {content}\n\nI wanted to share this with you."
+                response_text = serve_fallback(fallback_key('recipient', '', recipient, emotion, intensity), emotion, intensity, content)
         
         elif advisor and recipient:
             # Both features: Get advice and format it for sharing
-            print(f"Generating response from {advisor} perspective and formatting for {recipient}")
+            logger.debug("Generating response from %s perspective and formatting for %s", advisor, recipient)
             
             # Get advice first
             system_prompt = f"""You are a {advisor} providing support about someone's {emotion} feelings.
@@ -579,95 +1236,72 @@ IMPORTANT: You MUST follow this exact format (this is critical!):
 Example: "Dear [recipient], I wanted to share some advice from my [advisor] about my [emotion] feelings. They helped me understand that [brief advice]. [Closing appropriate to recipient]"
 """
 
-            user_message = f"""I'm feeling {emotion} with intensity level {intensity} (on a scale of 1-5) because: "{content}"
+            user_message = f"""I'm feeling {emotion} with intensity level {intensity} (on a scale of 1-5) because: "{entry_text}"
 First, provide me with supportive advice as my {advisor}.
 Then, format this advice to share with my {recipient}.
 Make sure the final response is formatted as a message to my {recipient} that includes the advice from my {advisor}."""
             
+            record_span('prompt', prompt_started)
             try:
                 # Get combined response from LLM
-                print(f"Sending combined advisor+recipient request to Ollama: {user_message[:100]}...")
-                response = ollama.chat(
-                    model='deepseek-r1:1.5b',
-                    messages=[
-                        {
-                            'role': 'system',
-                            'content': system_prompt
-                        },
-                        {
-                            'role': 'user',
-                            'content': user_message,
-                        }
-                    ],
-                    options={
-                        'temperature': 0.7
-                    }
-                )
-                
-                response_text = response['message']['content']
-                print(f"Raw combined Ollama response: {response_text[:100]}...")
-                
-                # Clean think tags from response
-                response_text = clean_think_tags(response_text)
+                response_text, model_used = generate('combined', system_prompt, user_message)
+                session_seed = (system_prompt, user_message)
+                logger.debug("Raw combined Ollama response", extra={'response': response_text})
                 
-                # Only apply minimal formatting if necessary
-                if not any(phrase in response_text.lower() for phrase in [f"dear {recipient}", f"to my {recipient}", f"hey {recipient}"]):
-                    greeting = "Personal reflection: " if recipient == "self" else f"Dear {recipient}, "
-                    response_text = f"{greeting}{response_text}"
+                # Strip reasoning and address the recipient if necessary
+                with span('postprocess'):
+                    response_text = combined_greeting(clean_think_tags(response_text), recipient)
                 
             except Exception as e:
-                print(f"Error getting combined response from LLM: {str(e)}")
+                logger.warning("Error getting combined response from LLM: %s", e)
                 # Fallback for combined response
-                if advisor == 'therapist':
-                    advice = f"As your therapist, I want to acknowledge that your feelings of {emotion} are completely valid. Emotions provide information about what matters to us. Consider what specific aspects of this situation are most challenging for you. Small coping strategies might help you navigate these feelings."
-                elif advisor == 'friend':
-                    advice = f"Hey there, as your friend, I just want to say I totally get why you're feeling {emotion}! That's a lot to deal with, but I know you've got this. Want to grab coffee soon? I'm always here to listen whenever you need me."
-                elif advisor == 'mentor':
-                    advice = f"As your mentor, I believe your {emotion} feelings highlight a growth opportunity. Consider how this connects to your broader goals. What skills are you developing through this challenge? Remember that discomfort often precedes significant development."
-                elif advisor == 'parent':
-                    advice = f"My dear, as your parent, I want you to know your {emotion} feelings make perfect sense. You've always been strong, and I have complete faith in you. Consider what small step might help you feel more grounded today. I'm always here for you."
-                else:
-                    advice = f"I understand your {emotion} feelings. It's natural to feel this way given your experience. What support would be most helpful right now? I'm here for you however you need."
-                
-                # Format for recipient
-                if recipient == 'self':
-                    response_text = f"Personal reflection: {advice}"
-                elif recipient == 'friend':
-                    response_text = f"Dear friend, my {advisor} shared this advice with me and I wanted to pass it along: {advice}"
-                elif recipient == 'partner':
-                    response_text = f"Dear partner, I talked with my {advisor} about how I've been feeling {emotion}, and they said: {advice}"
-                elif recipient == 'family':
-                    response_text = f"Dear family, I've been getting some support for my {emotion} feelings, and my {advisor} suggested: {advice}"
-                else:
-                    response_text = f"Dear {recipient}, I wanted to share some advice I received about my {emotion} feelings: {advice}"
+                response_text = serve_fallback(fallback_key('combined', advisor, recipient, emotion, intensity), emotion, intensity)
         
         else:
             # Default case
-            print("No advisor or recipient specified, using default response")
+            logger.debug("No advisor or recipient specified, using default response")
             response_text = f"Thank you for sharing how you feel {emotion}. I hope putting your thoughts into words has been helpful."
+            model_used = None
+        
+        result = fallback_fields({"response": response_text, "model": model_used})
+        if data.get('start_session') and session_seed:
+            # Let the client ask follow-ups without resending the entry and answer
+            messages = [
+                {'role': 'system', 'content': session_seed[0]},
+                {'role': 'user', 'content': session_seed[1]},
+                {'role': 'assistant', 'content': response_text}
+            ]
+            session = sessions.create(model_used, messages, context_size_for_messages(messages))
+            result['session_id'] = session['id']
         
-        print(f"Final response: {response_text[:100]}...")
-        return jsonify({"response": response_text})
+        with span('serialize'):
+            return jsonify(result)
     except Exception as e:
-        print(f"Error in /api/respond: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in /api/respond: %s", e)
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    if os.environ.get('SERVER_MODE', 'development') == 'production':
+        # Multi-worker server; see serve.py for the settings
+        import serve
+        serve.main()
+        sys.exit(0)
+
     # Add Ollama directory to PATH if not already there
-    ollama_dir = os.path.dirname(OLLAMA_PATH)
-    if ollama_dir not in os.environ['PATH']:
-        os.environ['PATH'] = ollama_dir + os.pathsep + os.environ['PATH']
+    if OLLAMA_PATH:
+        ollama_dir = os.path.dirname(OLLAMA_PATH)
+        if ollama_dir not in os.environ['PATH']:
+            os.environ['PATH'] = ollama_dir + os.pathsep + os.environ['PATH']
+        logger.info("Ollama path: %s", OLLAMA_PATH)
     
-    print("Starting Flask app with Ollama backend...")
-    print(f"Ollama path: {OLLAMA_PATH}")
+    logger.info("Starting Flask development server with Ollama backend...")
+    logger.info("Set SERVER_MODE=production to run the multi-worker server instead")
     
-    # Check Ollama is running
-    try:
-        models = ollama.list()
-        print(f"Ollama is running with models: {[m['name'] for m in models['models']]}")
-    except Exception as e:
-        print(f"Warning: Could not connect to Ollama: {str(e)}")
-        print("Make sure Ollama is running before making API calls")
+    # Check Ollama in the background so start-up doesn't wait on it
+    model_cache.warm()
         
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    # HTTP/1.1 so the development server keeps connections alive too
+    from werkzeug.serving import WSGIRequestHandler
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    debug = os.environ.get('FLASK_DEBUG', '1').lower() in ('1', 'true', 'yes')
+    app.run(debug=debug, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', '5000')))
@@ -0,0 +1,115 @@
+import sys
+import time
+
+from flask import Flask, jsonify, request
+from werkzeug.test import EnvironBuilder
+
+from http_layer import HttpLayer
+
+ALLOW_HEADERS = 'Content-Type, Authorization, X-API-Key'
+ALLOW_METHODS = 'GET, POST, PUT, DELETE, OPTIONS'
+EXPOSE_HEADERS = 'X-Request-ID, X-RateLimit-Limit, X-RateLimit-Remaining, X-RateLimit-Reset, Retry-After, X-Degraded'
+PREFLIGHT = {
+    'Origin': 'http://localhost:8081',
+    'Access-Control-Request-Method': 'POST',
+    'Access-Control-Request-Headers': 'content-type',
+}
+REQUEST = {
+    'Origin': 'http://localhost:8081',
+    'Accept-Encoding': 'gzip, deflate, br',
+}
+# A typical /api/respond answer, and a long one (e.g. a sync page)
+SMALL = {'response': "As your therapist, I want to acknowledge your feelings. " * 4, 'model': 'deepseek-r1:1.5b'}
+LARGE = {'changes': [{'id': str(i), 'op': 'upsert', 'entry': {'content': "Today I talked to my manager. " * 20}} for i in range(50)]}
+
+
+def routes(app, preflight=None):
+    """The benchmark routes, with the per-route OPTIONS handling app.py used to have"""
+    methods = ['POST', 'OPTIONS'] if preflight else ['POST']
+
+    @app.route('/api/respond', methods=methods)
+    def respond():
+        if request.method == 'OPTIONS':
+            return preflight()
+        return jsonify(SMALL)
+
+    @app.route('/api/sync', methods=methods)
+    def sync():
+        if request.method == 'OPTIONS':
+            return preflight()
+        return jsonify(LARGE)
+
+
+def old_app():
+    """flask_cors plus after_request .add() calls plus handle_preflight()"""
+    from flask_cors import CORS
+
+    app = Flask(__name__)
+    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+
+    def handle_preflight():
+        response = jsonify({'status': 'ok'})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', ALLOW_HEADERS)
+        response.headers.add('Access-Control-Allow-Methods', ALLOW_METHODS)
+        response.headers.add('Access-Control-Max-Age', '3600')
+        return response
+
+    @app.after_request
+    def after_request(response):
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', ALLOW_HEADERS)
+        response.headers.add('Access-Control-Allow-Methods', ALLOW_METHODS)
+        response.headers.add('Access-Control-Max-Age', '3600')
+        response.headers.add('Access-Control-Expose-Headers', EXPOSE_HEADERS)
+        return response
+
+    routes(app, handle_preflight)
+    return app
+
+
+def new_app():
+    app = Flask(__name__)
+    app.wsgi_app = HttpLayer(
+        app.wsgi_app,
+        allow_headers=ALLOW_HEADERS.split(', '),
+        allow_methods=ALLOW_METHODS.split(', '),
+        expose_headers=EXPOSE_HEADERS.split(', ')
+    )
+    routes(app)
+    return app
+
+
+def call(app, environ):
+    """One request straight through the WSGI stack, without a test client"""
+    captured = []
+    body = app.wsgi_app(dict(environ), lambda status, headers, exc_info=None: captured.append(headers))
+    data = b''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return captured[0], data
+
+
+def run(label, app, method, path, headers, iterations):
+    environ = EnvironBuilder(path, method=method, headers=headers).get_environ()
+    response_headers, data = call(app, environ)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call(app, environ)
+    elapsed = time.perf_counter() - start
+    cors = sum(1 for name, _ in response_headers if name.startswith('Access-Control-'))
+    print(f"{label:<28} {elapsed / iterations * 1e6:8.1f} us/request  {cors} CORS headers  {len(data):6d} bytes")
+
+
+def bench_http(iterations=3000):
+    """Compare per-request HTTP-layer overhead of the old and new setups"""
+    for name, app in (('old', old_app()), ('new', new_app())):
+        run(f"{name}: preflight", app, 'OPTIONS', '/api/respond', PREFLIGHT, iterations)
+        run(f"{name}: small JSON", app, 'POST', '/api/respond', REQUEST, iterations)
+        run(f"{name}: large JSON", app, 'POST', '/api/sync', REQUEST, iterations)
+    # Same as above without Accept-Encoding, to separate compression time
+    run("new: large JSON, no gzip", new_app(), 'POST', '/api/sync', {'Origin': REQUEST['Origin']}, iterations)
+
+
+if __name__ == "__main__":
+    bench_http(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,93 @@
+import logging
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from flask import Flask, g
+
+import log_config
+
+HEADERS = {
+    'Host': 'localhost:5000',
+    'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Expo/1017756',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Content-Type': 'application/json',
+    'Content-Length': '1834',
+    'Origin': 'http://localhost:8081',
+    'Connection': 'keep-alive',
+}
+CONTENT = "Today I finally talked to my manager about the project deadlines. " * 25
+DATA = {'content': CONTENT, 'emotion': 'anxious', 'advisorPerspective': 'therapist', 'intensity': 4}
+RESPONSE = "<think>" + "Let me consider how the user feels. " * 60 + "</think>" + "As your therapist, I hear you. " * 10
+
+
+def old_request_logging(logger):
+    """The per-request logging app.py did before the structured pipeline"""
+    logger.info("Received POST request to /api/respond")
+    logger.debug(f"Request headers: {dict(HEADERS)}")
+    logger.debug(f"Request data: {DATA}")
+    logger.info(f"POST /api/respond - Content: {CONTENT[:50]}... | Emotion: anxious | Advisor: therapist | Recipient:  | Intensity: 4")
+    print("Generating advisor response from therapist perspective")
+    print(f"Sending request to Ollama with user message: {CONTENT[:100]}...")
+    print(f"Raw Ollama response: {RESPONSE[:100]}...")
+    print(f"Final response: {RESPONSE[:100]}...")
+    logger.debug("Processing after_request hook")
+    logger.debug(f"Response headers: {dict(HEADERS)}")
+
+
+def new_request_logging(logger):
+    """The per-request logging app.py does now"""
+    logger.info("respond request", extra={
+        'content': CONTENT,
+        'emotion': 'anxious',
+        'advisor': 'therapist',
+        'recipient': '',
+        'intensity': 4
+    })
+    logger.debug("Generating advisor response from %s perspective", 'therapist')
+    logger.debug("Raw Ollama response", extra={'response': RESPONSE})
+    logger.info("request completed", extra={
+        'method': 'POST',
+        'path': '/api/respond',
+        'status': 200,
+        'duration_ms': 1234.5
+    })
+
+
+def run(label, fn, logger, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        g.log_sampled = log_config.should_sample()
+        g.request_id = 'bench'
+        fn(logger)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / iterations * 1e6:8.1f} us/request", file=sys.__stdout__)
+
+
+def bench_logging(iterations=5000):
+    """Compare per-request logging overhead of the old and new pipelines"""
+    app = Flask(__name__)
+    logger = logging.getLogger('bench')
+    # Line-buffered like stdout on a console or under a service manager
+    sink = tempfile.TemporaryFile('w+', buffering=1)
+
+    with app.test_request_context('/api/respond', method='POST'):
+        # Old setup: basicConfig(level=DEBUG) with a synchronous stream handler
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        logging.basicConfig(level=logging.DEBUG, stream=sink, force=True)
+        with redirect_stdout(sink):
+            run("old: print + DEBUG basicConfig", old_request_logging, logger, iterations)
+
+        for level, rate in (('DEBUG', 1.0), ('INFO', 1.0), ('INFO', 0.1)):
+            log_config.configure_logging(level=level, sample_rate=rate, stream=sink)
+            run(f"new: queue, level={level}, sample={rate}", new_request_logging, logger, iterations)
+        log_config.shutdown_logging()
+
+
+if __name__ == "__main__":
+    bench_logging(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,102 @@
+import random
+import re
+import sys
+import time
+
+from postprocess import ReplyStream, chat_greeting, clean_think_tags
+
+MESSAGE = "Please answer from the advisorPerspective of my therapist, then I'm sharing with a friend"
+WORDS = ("the user feels anxious about work so I should acknowledge that first and then suggest small "
+         "steps maybe breathing or a walk but keep it warm and not clinical").split()
+
+
+def old_clean_think_tags(text):
+    """The regex clean-up app.py used to run on every reply"""
+    cleaned_text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    cleaned_text = re.sub(r'</?think>', '', cleaned_text)
+    return cleaned_text.strip()
+
+
+def old_format(message, response_text):
+    """The per-advisor any()/lower() checks of the old format_response_if_needed"""
+    if "advisorPerspective" in message or "therapist" in message or "friend" in message or "mentor" in message or "parent" in message:
+        for advisor in ["therapist", "friend", "mentor", "parent"]:
+            if advisor in message.lower():
+                if advisor == "therapist" and not any(phrase in response_text.lower() for phrase in ["as your therapist", "from a therapeutic perspective", "as a therapist"]):
+                    return f"As your therapist, I want to acknowledge your feelings. {response_text}"
+                elif advisor == "friend" and not any(phrase in response_text.lower() for phrase in ["as your friend", "hey", "hi friend"]):
+                    return f"Hey there, as your friend, I just want to say I'm here for you. {response_text}"
+                elif advisor == "mentor" and not any(phrase in response_text.lower() for phrase in ["as your mentor", "from a mentorship perspective"]):
+                    return f"As your mentor, I see this as a growth opportunity. {response_text}"
+                elif advisor == "parent" and not any(phrase in response_text.lower() for phrase in ["as your parent", "my dear"]):
+                    return f"My dear, as your parent, I want you to know I care. {response_text}"
+    return response_text
+
+
+def reply(think_words, answer_words, seed=0):
+    """A deepseek-r1 style reply: a long <think> block, then the answer"""
+    rng = random.Random(seed)
+    think = ' '.join(rng.choice(WORDS) for _ in range(think_words))
+    answer = ' '.join(rng.choice(WORDS) for _ in range(answer_words))
+    return f"<think>\n{think}\n</think>\n\n{answer}"
+
+
+def tokens(text, size=4):
+    """Split a reply into stream chunks of about one token"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - start) / iterations * 1000, result
+
+
+def old_stream(chunks):
+    # The old path could only clean up once the whole reply had arrived
+    return old_format(MESSAGE, old_clean_think_tags(''.join(chunks)))
+
+
+def new_stream(chunks):
+    stream = ReplyStream(format_head=lambda head: chat_greeting(MESSAGE, head))
+    for chunk in chunks:
+        stream.feed(chunk)
+    stream.finish()
+    return stream.text
+
+
+def new_stream_tail(chunks):
+    """Time from the last chunk arriving to the reply being complete"""
+    stream = ReplyStream(format_head=lambda head: chat_greeting(MESSAGE, head))
+    for chunk in chunks:
+        stream.feed(chunk)
+    start = time.perf_counter()
+    stream.finish()
+    return (time.perf_counter() - start) * 1000
+
+
+def bench_postprocess(iterations=50):
+    """Compare the old and new reply post-processing on large reasoning outputs"""
+    for think_words, answer_words in ((500, 150), (5000, 300), (50000, 300)):
+        text = reply(think_words, answer_words)
+        chunks = tokens(text)
+        label = f"{len(text) // 1000}k chars"
+        old_ms, old_result = timed(lambda: old_format(MESSAGE, old_clean_think_tags(text)), iterations)
+        new_ms, new_result = timed(lambda: chat_greeting(MESSAGE, clean_think_tags(text)), iterations)
+        assert old_result == new_result
+        print(f"{label:<12} whole reply:  old {old_ms:8.3f} ms  new {new_ms:8.3f} ms")
+        old_ms, old_result = timed(lambda: old_stream(chunks), iterations)
+        new_ms, new_result = timed(lambda: new_stream(chunks), iterations)
+        assert old_result == new_result
+        # Not like for like: the old code could only clean up once every chunk had arrived
+        print(f"{label:<12} {len(chunks)} chunks: old {old_ms:8.3f} ms  new {new_ms:8.3f} ms "
+              f"(new: {new_ms / len(chunks) * 1000:.2f} us per chunk as it arrives)")
+        # What the user waits for once the model's last token is out: all of
+        # the old clean-up, but only the new stream's final flush
+        tail_ms = sum(new_stream_tail(chunks) for _ in range(iterations)) / iterations
+        print(f"{label:<12} after last chunk: old {old_ms:8.3f} ms  new {tail_ms:8.3f} ms")
+
+
+if __name__ == "__main__":
+    bench_postprocess(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,204 @@
+import time
+
+from postprocess import ADVISOR_GREETINGS, CLOSE_TAG, GREETINGS, OPEN_TAG, REQUEST_MARKERS
+
+# Canned replies, the last resort when no real response can be served.
+# Keyed by emotion / advisor / recipient; None is the default. Formatted
+# with emotion, intensity, content, advisor and recipient.
+ANALYSIS_TEMPLATES = {
+    'happy': "I sense that you're feeling {emotion} with {intensity} intensity. Your journal entry shows genuine joy and a positive outlook. This happiness seems to stem from recent achievements or connections in your life. Savor these positive emotions and consider what contributed to them.",
+    'sad': "I notice a sense of {emotion}ness with {intensity} intensity in your writing. Your journal reflects some difficult emotions that you're processing thoughtfully. This sadness appears connected to meaningful aspects of your life, showing what you value. Be gentle with yourself as you navigate these feelings.",
+    'angry': "Your writing shows {emotion} feelings with {intensity} intensity. This emotion often signals boundaries being crossed or needs not being met. Your awareness of these feelings is a strength and indicates self-awareness. Consider what specific needs might be underlying this emotional response.",
+    'anxious': "I sense {emotion}ness with {intensity} intensity in your journal entry. Your thoughtful reflection shows you're engaging with these feelings rather than avoiding them. This anxiety may be highlighting areas where you care deeply or feel uncertainty. Small steps toward addressing specific concerns could be helpful.",
+    None: "I sense that you're feeling {emotion} with {intensity} intensity. Your journal entry shows self-awareness and a desire to understand these emotions better. Reflecting on your feelings this way is a helpful practice for emotional well-being.",
+}
+ADVISOR_TEMPLATES = {
+    'therapist': "As your therapist, I want to acknowledge that your feelings of {emotion} are completely valid. Emotions often provide valuable information about what matters to us and what we need. What aspects of this situation feel most significant to you right now? Remember that developing small coping strategies can make a meaningful difference.",
+    'friend': "Hey there, as your friend, I just want to say I totally get why you're feeling {emotion}! That's a lot to deal with, but I've seen you handle tough stuff before. Want to grab coffee soon and talk more about it? I'm always here for you, no matter what.",
+    'mentor': "As your mentor, I believe your {emotion} feelings highlight an important growth opportunity. Consider how this challenge connects to your broader goals and values. What skills might you develop by navigating this situation thoughtfully? Remember that discomfort often precedes significant development.",
+    'parent': "My dear, as your parent, I want you to know that your {emotion} feelings are completely understandable. You've always had such strength in facing challenges, and I have complete faith in you now. What small step might help you feel more grounded today? I'm always here for you, no matter what.",
+    None: "As someone who cares about you, I want to say I understand your {emotion} feelings. It's perfectly natural to feel this way given what you're experiencing. What support would be most helpful right now? I'm here for you however you need.",
+}
+RECIPIENT_TEMPLATES = {
+    'self': "Personal reflection: I've been feeling {emotion} with intensity level {intensity}.\n\n{content}\n\nI need to remember this moment and what I've learned from it.",
+    'friend': "Dear friend, I wanted to share something with you. I've been feeling {emotion} with intensity level {intensity} because: {content}\n\nI'd value your thoughts on this if you have time to talk.",
+    'partner': "Dear partner, I wanted to open up to you about something I've been feeling. I've experienced {emotion} with intensity level {intensity} recently: {content}\n\nI'm sharing this because you're important to me and I value our connection.",
+    'family': "Dear family, I wanted to share with you that I've been feeling {emotion} with intensity level {intensity} lately: {content}\n\nI'm sharing this with you because family support means a lot to me.",
+    None: "Dear {recipient}, I've been feeling {emotion} with intensity level {intensity} because: {content}\n\nI wanted to share this with you.",
+}
+# Advice for both features at once, then the message passing it on ({advice})
+COMBINED_ADVICE = {
+    'therapist': "As your therapist, I want to acknowledge that your feelings of {emotion} are completely valid. Emotions provide information about what matters to us. Consider what specific aspects of this situation are most challenging for you. Small coping strategies might help you navigate these feelings.",
+    'friend': "Hey there, as your friend, I just want to say I totally get why you're feeling {emotion}! That's a lot to deal with, but I know you've got this. Want to grab coffee soon? I'm always here to listen whenever you need me.",
+    'mentor': "As your mentor, I believe your {emotion} feelings highlight a growth opportunity. Consider how this connects to your broader goals. What skills are you developing through this challenge? Remember that discomfort often precedes significant development.",
+    'parent': "My dear, as your parent, I want you to know your {emotion} feelings make perfect sense. You've always been strong, and I have complete faith in you. Consider what small step might help you feel more grounded today. I'm always here for you.",
+    None: "I understand your {emotion} feelings. It's natural to feel this way given your experience. What support would be most helpful right now? I'm here for you however you need.",
+}
+COMBINED_TEMPLATES = {
+    'self': "Personal reflection: {advice}",
+    'friend': "Dear friend, my {advisor} shared this advice with me and I wanted to pass it along: {advice}",
+    'partner': "Dear partner, I talked with my {advisor} about how I've been feeling {emotion}, and they said: {advice}",
+    'family': "Dear family, I've been getting some support for my {emotion} feelings, and my {advisor} suggested: {advice}",
+    None: "Dear {recipient}, I wanted to share some advice I received about my {emotion} feelings: {advice}",
+}
+# Free-form /api/chat, by the advisor or recipient the message mentions
+CHAT_ADVISOR_TEMPLATES = {
+    'therapist': "As your therapist, I want to acknowledge that it's completely normal to feel this way. Your emotions are valid and provide important information about what matters to you. What specific aspects of this situation feel most challenging right now? Remember that developing small coping strategies can make a significant difference.",
+    'friend': "Hey there, as your friend, I just want to say I'm totally here for you! We all go through tough times, and you're handling this like a champ. Want to grab coffee soon and talk more about it? I bet we could brainstorm some fun distractions if you need a break from everything.",
+    'mentor': "As your mentor, I believe this experience offers valuable growth opportunities. Consider how this challenge connects to your longer-term goals. What skills are you developing through this situation that will serve you well in the future? Remember that discomfort often precedes significant development.",
+    'parent': "My dear, as your parent, I want you to know I'm always here for you. You have shown such strength in difficult situations before, and I have complete faith in your ability to navigate this too. What small step could you take today that might make things a little easier?",
+}
+CHAT_RECIPIENT_TEMPLATES = {
+    'self': "Personal reflection: I've been experiencing some challenging emotions lately. I'm noticing patterns in how I respond to stress, and I'm working on developing healthier coping strategies. I'm proud of myself for taking time to process these feelings.",
+    'friend': "Dear friend, I wanted to share something I've been going through lately. I've had some ups and downs with my emotions, and I'd value your perspective when you have time. No pressure for advice - sometimes just talking helps. Let me know if you'd be up for coffee soon?",
+    'partner': "Dear partner, I've been reflecting on my emotional state lately and wanted to open up to you about it. You're such an important part of my support system, and sharing these feelings with you helps me process them. I appreciate your patience and understanding.",
+    'family': "Dear family, I wanted to share some thoughts I've been having lately. Family support means so much to me, and I value the perspective you all bring. I'm working through some emotions and thought it might help to express them to people who know me well.",
+    None: "Thank you for sharing your thoughts and feelings. I appreciate your openness and trust. Is there a specific aspect of this situation you'd like to explore further?",
+}
+
+# Features whose replies can stand in for another request with the same key.
+# Recipient and combined replies restate the journal entry itself and chat
+# replies answer one specific message, so they are never reused.
+POOLED_FEATURES = ('analysis', 'advisor')
+
+
+def intensity_bucket(intensity):
+    try:
+        intensity = int(intensity)
+    except (TypeError, ValueError):
+        intensity = 3
+    return 'low' if intensity <= 2 else 'high' if intensity >= 4 else 'mid'
+
+
+def fallback_key(feature, advisor='', recipient='', emotion='', intensity=3):
+    """Index of a request: (feature, advisor, recipient, emotion, intensity bucket)"""
+    return (feature, (advisor or '').lower(), (recipient or '').lower(), (emotion or '').lower(),
+            intensity_bucket(intensity))
+
+
+def chat_key(message):
+    """Fallback key of a free-form chat message, from the advisor or recipient it mentions"""
+    markers = REQUEST_MARKERS.find(message)
+    # Advisors first, as the original checks did ("sharing with friend" reads as the friend advisor)
+    for advisor in CHAT_ADVISOR_TEMPLATES:
+        if advisor in markers:
+            return fallback_key('chat', advisor=advisor)
+    if 'sharing with' in markers:
+        for recipient in ('self', 'friend', 'partner', 'family'):
+            if recipient in markers:
+                return fallback_key('chat', recipient=recipient)
+    return fallback_key('chat')
+
+
+def template_reply(key, emotion='', intensity=3, content=''):
+    """The static reply for a key"""
+    feature, advisor, recipient, emotion_key, _ = key
+    fields = {'emotion': emotion, 'intensity': intensity, 'content': content,
+              'advisor': advisor, 'recipient': recipient}
+    if feature == 'analysis':
+        return ANALYSIS_TEMPLATES.get(emotion_key, ANALYSIS_TEMPLATES[None]).format(**fields)
+    if feature == 'advisor':
+        return ADVISOR_TEMPLATES.get(advisor, ADVISOR_TEMPLATES[None]).format(**fields)
+    if feature == 'recipient':
+        return RECIPIENT_TEMPLATES.get(recipient, RECIPIENT_TEMPLATES[None]).format(**fields)
+    if feature == 'combined':
+        fields['advice'] = COMBINED_ADVICE.get(advisor, COMBINED_ADVICE[None]).format(**fields)
+        return COMBINED_TEMPLATES.get(recipient, COMBINED_TEMPLATES[None]).format(**fields)
+    if advisor:
+        return CHAT_ADVISOR_TEMPLATES[advisor]
+    return CHAT_RECIPIENT_TEMPLATES.get(recipient or None, CHAT_RECIPIENT_TEMPLATES[None])
+
+
+class FallbackResponses:
+    """Replies for when Ollama is unavailable or the client is over budget.
+
+    Good real replies are kept in a small pool per fallback key and client
+    (``owner``), shared by all worker processes, and served in rotation
+    (least recently served first) before falling back to the static
+    templates. Pools are per owner because even generic replies mention
+    details of the entry they answered. Only owners identified by an API
+    key (``key:...``) get a pool: an address (``ip:...``) can be shared by
+    many users behind NAT or a proxy, so those callers get the templates.
+    """
+
+    def __init__(self, state, pool_size=5, max_age=7 * 86400, min_chars=80, max_chars=3000):
+        self.state = state
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        with self.state.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS fallback_pool ("
+                "id INTEGER PRIMARY KEY, key TEXT NOT NULL, owner TEXT NOT NULL, text TEXT NOT NULL, "
+                "model TEXT, created_at REAL NOT NULL, served_at REAL NOT NULL DEFAULT 0)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS fallback_pool_key ON fallback_pool (key, owner, served_at)")
+
+    @staticmethod
+    def pooled(key, owner):
+        """Whether replies for this key and owner are pooled and served again"""
+        return key[0] in POOLED_FEATURES and bool(owner) and owner.startswith('key:')
+
+    def is_good(self, key, text):
+        """Whether a real reply is worth serving again: complete, sized and in format"""
+        text = text.strip()
+        if not self.min_chars <= len(text) <= self.max_chars:
+            return False
+        if OPEN_TAG in text or CLOSE_TAG in text:
+            return False
+        # Cut off by a length limit
+        if text[-1] not in '.!?"\')*':
+            return False
+        feature, advisor = key[0], key[1]
+        if feature == 'advisor' and advisor in ADVISOR_GREETINGS:
+            return bool(GREETINGS.find(text[:300]).intersection(ADVISOR_GREETINGS[advisor]))
+        return True
+
+    def record(self, key, owner, text, model):
+        """Add a real reply to the key's pool if it qualifies; True if it was added"""
+        if not self.pooled(key, owner) or not self.is_good(key, text):
+            return False
+        pool_key = '|'.join(key)
+        now = time.time()
+        with self.state.transaction() as db:
+            if db.execute(
+                "SELECT 1 FROM fallback_pool WHERE key = ? AND owner = ? AND text = ?", (pool_key, owner, text)
+            ).fetchone():
+                return False
+            db.execute(
+                "INSERT INTO fallback_pool (key, owner, text, model, created_at) VALUES (?, ?, ?, ?, ?)",
+                (pool_key, owner, text, model, now)
+            )
+            db.execute(
+                "DELETE FROM fallback_pool WHERE key = ? AND owner = ? AND (created_at <= ? OR id IN "
+                "(SELECT id FROM fallback_pool WHERE key = ? AND owner = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?))",
+                (pool_key, owner, now - self.max_age, pool_key, owner, self.pool_size)
+            )
+        return True
+
+    def cached(self, key, owner):
+        """Next pooled reply for the key in rotation, as (text, model), or None"""
+        if not self.pooled(key, owner):
+            return None
+        with self.state.transaction() as db:
+            row = db.execute(
+                "SELECT id, text, model FROM fallback_pool WHERE key = ? AND owner = ? AND created_at > ? "
+                "ORDER BY served_at, created_at DESC LIMIT 1",
+                ('|'.join(key), owner, time.time() - self.max_age)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE fallback_pool SET served_at = ? WHERE id = ?", (time.time(), row[0]))
+        return row[1], row[2]
+
+    def serve(self, key, owner=None, emotion='', intensity=3, content=''):
+        """Best available stand-in reply: (text, source), source 'cached' or 'template'"""
+        cached = self.cached(key, owner)
+        if cached:
+            return cached[0], 'cached'
+        return template_reply(key, emotion, intensity, content), 'template'
+
+    def stats(self):
+        row = self.state.execute("SELECT COUNT(*), COUNT(DISTINCT key || '|' || owner) FROM fallback_pool").fetchone()
+        return {'responses': row[0], 'pools': row[1]}
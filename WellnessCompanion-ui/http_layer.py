@@ -0,0 +1,168 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+
+def _accepted_encodings(header):
+    """Encodings the client accepts, from an Accept-Encoding header"""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class _GzipStream:
+    def __init__(self, level):
+        # wbits 31 = gzip container
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        """Emit everything compressed so far without ending the stream"""
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream:
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class HttpLayer:
+    """WSGI middleware for the cross-cutting HTTP concerns of every route.
+
+    * CORS preflight (OPTIONS) requests are answered here, before Flask
+      routes, logs or profiles anything, with a header list built once.
+    * Every other response gets each CORS header exactly once.
+    * JSON, NDJSON and text bodies of at least ``min_size`` bytes are
+      compressed with brotli (if installed) or gzip when the client accepts
+      it. Streamed bodies (no Content-Length) are compressed chunk by chunk
+      and flushed after each chunk, so streaming still works.
+    """
+
+    def __init__(self, app, allow_origin='*', allow_headers=(), allow_methods=(), expose_headers=(),
+                 max_age=3600, min_size=1024, gzip_level=5, brotli_level=4):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_level = brotli_level
+        self.cors_headers = [('Access-Control-Allow-Origin', allow_origin)]
+        if expose_headers:
+            self.cors_headers.append(('Access-Control-Expose-Headers', ', '.join(expose_headers)))
+        self.preflight_headers = [
+            ('Access-Control-Allow-Origin', allow_origin),
+            ('Access-Control-Allow-Headers', ', '.join(allow_headers)),
+            ('Access-Control-Allow-Methods', ', '.join(allow_methods)),
+            ('Access-Control-Max-Age', str(max_age)),
+            ('Content-Length', '0'),
+        ]
+        self._cors_names = {name.lower() for name, _ in self.preflight_headers + self.cors_headers} - {'content-length'}
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'OPTIONS':
+            start_response('204 No Content', self.preflight_headers)
+            return []
+
+        encoding = None
+        accepted = environ.get('HTTP_ACCEPT_ENCODING')
+        if accepted:
+            accepted = _accepted_encodings(accepted)
+            if brotli is not None and 'br' in accepted:
+                encoding = 'br'
+            elif 'gzip' in accepted:
+                encoding = 'gzip'
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            headers = [(name, value) for name, value in headers if name.lower() not in self._cors_names]
+            headers.extend(self.cors_headers)
+            captured['status'], captured['headers'], captured['exc_info'] = status, headers, exc_info
+            if encoding is None:
+                return start_response(status, headers, exc_info)
+            # Decided (and start_response called) once the body size is known
+            return lambda data: None
+
+        body = self.app(environ, capture)
+        if encoding is None:
+            return body
+        return self._encode(body, start_response, captured, encoding)
+
+    def _should_compress(self, status, headers):
+        if status[:3] in ('204', '304') or int(status[:3]) < 200:
+            return False, None
+        length = None
+        content_type = ''
+        for name, value in headers:
+            lname = name.lower()
+            if lname == 'content-encoding':
+                return False, None
+            if lname == 'content-type':
+                content_type = value
+            elif lname == 'content-length':
+                length = int(value)
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False, length
+        return length is None or length >= self.min_size, length
+
+    def _compressor(self, encoding):
+        return _BrotliStream(self.brotli_level) if encoding == 'br' else _GzipStream(self.gzip_level)
+
+    def _encode(self, body, start_response, captured, encoding):
+        status, headers = captured['status'], captured['headers']
+        compress, length = self._should_compress(status, headers)
+        if not compress:
+            start_response(status, headers, captured['exc_info'])
+            return body
+
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        headers.append(('Content-Encoding', encoding))
+        headers.append(('Vary', 'Accept-Encoding'))
+        stream = self._compressor(encoding)
+
+        if length is not None:
+            # Buffered response (jsonify): compress in one go
+            try:
+                data = stream.compress(b''.join(body)) + stream.finish()
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            headers.append(('Content-Length', str(len(data))))
+            start_response(status, headers, captured['exc_info'])
+            return [data]
+
+        start_response(status, headers, captured['exc_info'])
+        return self._stream(body, stream)
+
+    @staticmethod
+    def _stream(body, stream):
+        try:
+            for chunk in body:
+                if chunk:
+                    yield stream.compress(chunk) + stream.flush()
+            yield stream.finish()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
@@ -0,0 +1,89 @@
+import hashlib
+import time
+
+
+class IdempotencyStore:
+    """Results of requests sent with an Idempotency-Key, shared by all worker processes.
+
+    The first request with a key claims it and generates; the stored result
+    is then returned to any repeat of the key for ``ttl`` seconds. A repeat
+    that arrives while the first request is still running waits for it
+    instead of starting a second generation. A claim whose request crashed
+    without releasing it lapses after ``lease`` seconds.
+    """
+
+    def __init__(self, state, ttl=86400, lease=300, poll_interval=0.05, max_poll_interval=0.5):
+        self.state = state
+        self.ttl = ttl
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        with self.state.transaction() as db:
+            # status is NULL while the first request is still generating
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER, body BLOB, "
+                "content_type TEXT, expires_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+
+    @staticmethod
+    def fingerprint(body):
+        return hashlib.sha256(body).hexdigest()
+
+    def claim(self, key, fingerprint):
+        """Claim ``key`` for a request whose body hashes to ``fingerprint``.
+
+        Returns ('new', None) when the caller should generate, ('done',
+        result) with the stored result, ('pending', None) while another
+        request holds the key, or ('mismatch', None) when the key was used
+        for a different body.
+        """
+        now = time.time()
+        with self.state.transaction() as db:
+            db.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, expires_at) VALUES (?, ?, ?)",
+                (key, fingerprint, now + self.lease)
+            )
+            if cursor.rowcount == 1:
+                return 'new', None
+            row = db.execute(
+                "SELECT fingerprint, status, body, content_type FROM idempotency_keys WHERE key = ?", (key,)
+            ).fetchone()
+        if row[0] != fingerprint:
+            return 'mismatch', None
+        if row[1] is None:
+            return 'pending', None
+        return 'done', {'status': row[1], 'body': row[2], 'content_type': row[3]}
+
+    def wait(self, key, fingerprint, timeout):
+        """Claim ``key``, waiting up to ``timeout`` seconds while another request holds it.
+
+        If the holder fails and releases the key, the waiter claims it and
+        generates itself.
+        """
+        deadline = time.monotonic() + timeout
+        interval = self.poll_interval
+        while True:
+            outcome = self.claim(key, fingerprint)
+            remaining = deadline - time.monotonic()
+            if outcome[0] != 'pending' or remaining <= 0:
+                return outcome
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.max_poll_interval)
+
+    def complete(self, key, status, body, content_type):
+        """Store the result of a claimed key for repeats within the retention window"""
+        now = time.time()
+        with self.state.transaction() as db:
+            db.execute(
+                "UPDATE idempotency_keys SET status = ?, body = ?, content_type = ?, expires_at = ? "
+                "WHERE key = ? AND status IS NULL",
+                (status, body, content_type, now + self.ttl, key)
+            )
+            db.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+
+    def release(self, key):
+        """Give up a claim without a result, so the next repeat generates again"""
+        self.state.execute("DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL", (key,))
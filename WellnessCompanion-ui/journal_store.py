@@ -0,0 +1,242 @@
+import json
+import time
+
+# Columns of journal_entries and the JournalEntry fields (src/types) they hold
+ENTRY_FIELDS = (
+    ('entry_date', 'date'),
+    ('emotion', 'emotion'),
+    ('content', 'content'),
+    ('is_voice_note', 'isVoiceNote'),
+    ('ai_summary', 'aiSummary'),
+    ('advisor_perspective', 'advisorPerspective'),
+    ('recipient', 'recipient'),
+    ('is_logged', 'isLogged'),
+)
+
+
+class JournalStore:
+    """Server-side copy of users' journal entries.
+
+    Uses a SharedState database for its connection handling, so it can be
+    opened from every worker process and from the batch tools. Entries are
+    keyed by user and the id the app assigns them (ids are only unique per
+    device, so two users may pick the same one); ``emotion`` is stored as
+    the JSON of the app's Emotion object.
+
+    Every write also goes to the journal_changes log, whose autoincrement
+    ``seq`` is the sync cursor. The log holds one row per entry (the latest
+    change, with deletions kept as tombstones), so reading the changes since
+    a cursor costs O(changes) however long a user's history is.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        with self.db.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal_entries ("
+                "id TEXT NOT NULL, user_id TEXT NOT NULL, entry_date TEXT, emotion TEXT, "
+                "content TEXT NOT NULL DEFAULT '', is_voice_note INTEGER NOT NULL DEFAULT 0, "
+                "ai_summary TEXT, advisor_perspective TEXT, recipient TEXT, "
+                "is_logged INTEGER NOT NULL DEFAULT 0, ai_model TEXT, analysis_version TEXT, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (user_id, id))"
+            )
+            # Batch jobs walk all users' entries in (id, user_id) order
+            conn.execute("CREATE INDEX IF NOT EXISTS journal_entries_batch ON journal_entries (id, user_id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal_changes ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, entry_id TEXT NOT NULL, "
+                "op TEXT NOT NULL, changed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS journal_changes_entry ON journal_changes (user_id, entry_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS journal_changes_cursor ON journal_changes (user_id, seq)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_jobs ("
+                "job TEXT PRIMARY KEY, last_id TEXT NOT NULL, done INTEGER NOT NULL, "
+                "failed INTEGER NOT NULL, data TEXT, updated_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def _row_values(entry):
+        emotion = entry.get('emotion')
+        return (
+            entry.get('date'),
+            json.dumps(emotion) if emotion is not None else None,
+            entry.get('content', ''),
+            int(bool(entry.get('isVoiceNote'))),
+            entry.get('aiSummary'),
+            entry.get('advisorPerspective'),
+            entry.get('recipient'),
+            int(bool(entry.get('isLogged'))),
+        )
+
+    @staticmethod
+    def to_entry(row):
+        """Turn a journal_entries row (as a dict) into the app's JournalEntry shape"""
+        entry = {'id': row['id']}
+        for column, field in ENTRY_FIELDS:
+            entry[field] = row[column]
+        entry['emotion'] = json.loads(entry['emotion']) if entry['emotion'] else None
+        entry['isVoiceNote'] = bool(entry['isVoiceNote'])
+        entry['isLogged'] = bool(entry['isLogged'])
+        return entry
+
+    @staticmethod
+    def _log_changes(conn, changes, now):
+        """Record (user_id, entry_id, op) changes, replacing each entry's previous one"""
+        conn.executemany(
+            "INSERT OR REPLACE INTO journal_changes (user_id, entry_id, op, changed_at) VALUES (?, ?, ?, ?)",
+            [(user_id, entry_id, op, now) for user_id, entry_id, op in changes]
+        )
+
+    def save_entries(self, user_id, entries, deleted_ids=()):
+        """Insert or replace a user's entries and delete others in one transaction.
+
+        Returns how many entries were saved and deleted. No cursor is
+        returned: one taken after the write would skip changes other
+        devices made before it, so devices keep pulling from their own.
+        """
+        now = time.time()
+        columns = ', '.join(column for column, _ in ENTRY_FIELDS)
+        updates = ', '.join(f"{column} = excluded.{column}" for column, _ in ENTRY_FIELDS)
+        with self.db.transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO journal_entries (id, user_id, {columns}, updated_at) "
+                f"VALUES (?, ?, {', '.join('?' for _ in ENTRY_FIELDS)}, ?) "
+                f"ON CONFLICT(user_id, id) DO UPDATE SET {updates}, updated_at = excluded.updated_at",
+                [(entry['id'], user_id) + self._row_values(entry) + (now,) for entry in entries]
+            )
+            saved = list(dict.fromkeys(entry['id'] for entry in entries))
+            removed = [
+                entry_id for (entry_id,) in conn.execute(
+                    f"SELECT id FROM journal_entries WHERE user_id = ? "
+                    f"AND id IN ({', '.join('?' for _ in deleted_ids)})",
+                    [user_id] + list(deleted_ids)
+                )
+            ] if deleted_ids else []
+            conn.executemany(
+                "DELETE FROM journal_entries WHERE id = ? AND user_id = ?",
+                [(entry_id, user_id) for entry_id in removed]
+            )
+            self._log_changes(
+                conn,
+                [(user_id, entry_id, 'upsert') for entry_id in saved]
+                + [(user_id, entry_id, 'delete') for entry_id in removed],
+                now
+            )
+            return {
+                'saved': len(saved),
+                'deleted': len(removed)
+            }
+
+    def latest_cursor(self, user_id):
+        row = self.db.execute("SELECT MAX(seq) FROM journal_changes WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] or 0
+
+    def changes_since(self, user_id, cursor, limit=500):
+        """Up to ``limit`` changes after ``cursor`` in order, and whether more follow.
+
+        Each change is ``{'cursor', 'op', 'id'}`` plus the full ``entry`` for
+        upserts; an entry edited several times since the cursor appears once.
+        """
+        rows = self.db.execute(
+            "SELECT c.seq, c.op, c.entry_id, e.* FROM journal_changes c "
+            "LEFT JOIN journal_entries e ON e.user_id = c.user_id AND e.id = c.entry_id AND c.op = 'upsert' "
+            "WHERE c.user_id = ? AND c.seq > ? ORDER BY c.seq LIMIT ?",
+            (user_id, cursor, limit + 1)
+        )
+        columns = [description[0] for description in rows.description]
+        rows = rows.fetchall()
+        changes = []
+        for row in rows[:limit]:
+            seq, op, entry_id = row[:3]
+            change = {'cursor': seq, 'op': op, 'id': entry_id}
+            if op == 'upsert' and row[3] is not None:
+                entry = self.to_entry(dict(zip(columns[3:], row[3:])))
+                change['entry'] = {field: value for field, value in entry.items() if value is not None}
+            changes.append(change)
+        return changes, len(rows) > limit
+
+    def _pending_filter(self, version, user_id, force):
+        clauses, params = [], []
+        if not force:
+            clauses.append("(analysis_version IS NULL OR analysis_version != ?)")
+            params.append(version)
+        if user_id:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        return clauses, params
+
+    def count_pending(self, version, after=('', ''), user_id=None, force=False):
+        """Entries after the ``(id, user_id)`` key ``after`` that still need analysis ``version``"""
+        clauses, params = self._pending_filter(version, user_id, force)
+        where = ' AND '.join(['(id, user_id) > (?, ?)'] + clauses)
+        return self.db.execute(
+            f"SELECT COUNT(*) FROM journal_entries WHERE {where}", list(after) + params
+        ).fetchone()[0]
+
+    def iter_pending(self, version, after=('', ''), user_id=None, force=False, page_size=500):
+        """Stream entries needing re-analysis in (id, user_id) order, one page at a time.
+
+        Pages are read with a keyset (``(id, user_id) > last``) query, so
+        memory stays flat and each page costs the same however far into the
+        table it is.
+        """
+        clauses, params = self._pending_filter(version, user_id, force)
+        where = ' AND '.join(['(id, user_id) > (?, ?)'] + clauses)
+        last = list(after)
+        while True:
+            cursor = self.db.execute(
+                f"SELECT id, user_id, emotion, content FROM journal_entries WHERE {where} "
+                f"ORDER BY id, user_id LIMIT ?",
+                last + params + [page_size]
+            )
+            rows = cursor.fetchall()
+            for entry_id, owner, emotion, content in rows:
+                emotion = json.loads(emotion) if emotion else {}
+                yield {'id': entry_id, 'user_id': owner, 'emotion': emotion, 'content': content}
+            if len(rows) < page_size:
+                return
+            last = list(rows[-1][:2])
+
+    def save_analyses(self, results, version, job=None, checkpoint=None):
+        """Write a batch of (user_id, entry_id, ai_summary, model) and the job checkpoint atomically.
+
+        ``checkpoint`` is a dict with ``last_id``, ``last_user``, ``done``
+        and ``failed``;
+        storing it in the same transaction as the summaries means a resumed
+        job never redoes or skips a committed batch.
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE journal_entries SET ai_summary = ?, ai_model = ?, analysis_version = ?, "
+                "updated_at = ? WHERE user_id = ? AND id = ?",
+                [(summary, model, version, now, user_id, entry_id) for user_id, entry_id, summary, model in results]
+            )
+            # New summaries reach devices through the next sync
+            conn.executemany(
+                "INSERT OR REPLACE INTO journal_changes (user_id, entry_id, op, changed_at) "
+                "SELECT user_id, id, 'upsert', ? FROM journal_entries WHERE user_id = ? AND id = ?",
+                [(now, user_id, entry_id) for user_id, entry_id, _, _ in results]
+            )
+            if job and checkpoint:
+                conn.execute(
+                    "INSERT INTO batch_jobs (job, last_id, done, failed, data, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(job) DO UPDATE SET last_id = excluded.last_id, done = excluded.done, "
+                    "failed = excluded.failed, data = excluded.data, updated_at = excluded.updated_at",
+                    (job, checkpoint['last_id'], checkpoint['done'], checkpoint['failed'],
+                     json.dumps({'version': version, 'last_user': checkpoint['last_user']}), now)
+                )
+
+    def checkpoint(self, job):
+        row = self.db.execute(
+            "SELECT last_id, done, failed, data FROM batch_jobs WHERE job = ?", (job,)
+        ).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[3]) if row[3] else {}
+        return {'last_id': row[0], 'last_user': data.get('last_user', ''), 'done': row[1], 'failed': row[2]}
+
+    def clear_checkpoint(self, job):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM batch_jobs WHERE job = ?", (job,))
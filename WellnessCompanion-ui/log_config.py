@@ -0,0 +1,148 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+from flask import g, has_request_context
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Fields that may carry journal text or LLM output and must never be logged verbatim
+SENSITIVE_FIELDS = {'content', 'user_message', 'system_prompt', 'response', 'analysis', 'prompt', 'transcript'}
+
+_listener = None
+_queue_handler = None
+_include_content = False
+_sample_rate = 1.0
+
+
+def redact(value):
+    """Replace user text with a length marker unless content logging is enabled"""
+    if _include_content or value is None:
+        return value
+    return f"<redacted {len(str(value))} chars>"
+
+
+class _DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+
+    def prepare(self, record):
+        # Resolve %-args now since they may reference objects that change later
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra=` fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with `extra=` fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        extras = [f"{key}={value}" for key, value in record.__dict__.items()
+                  if key not in _RECORD_ATTRS and not key.startswith('_')]
+        return f"{line} {' '.join(extras)}" if extras else line
+
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the request id, drop unsampled ones and redact content.
+
+    Runs on the caller's thread (it is attached to the QueueHandler) because
+    the Flask request context is thread-local.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            if record.levelno < logging.WARNING and not getattr(g, 'log_sampled', True):
+                return False
+            record.request_id = getattr(g, 'request_id', None)
+        if not _include_content:
+            for field in SENSITIVE_FIELDS.intersection(record.__dict__):
+                setattr(record, field, redact(record.__dict__[field]))
+        return True
+
+
+def should_sample():
+    """Decide whether this request's INFO/DEBUG logs are kept"""
+    return _sample_rate >= 1.0 or random.random() < _sample_rate
+
+
+def configure_logging(level=None, fmt=None, sample_rate=None, include_content=None, stream=None):
+    """Route all logging through a queue drained by a background thread.
+
+    Settings default to the LOG_LEVEL, LOG_FORMAT (json|text),
+    LOG_SAMPLE_RATE and LOG_INCLUDE_CONTENT environment variables. Safe to
+    call again, e.g. in a worker process after fork.
+    """
+    global _listener, _queue_handler, _include_content, _sample_rate
+
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'json')
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+    if include_content is None:
+        include_content = os.environ.get('LOG_INCLUDE_CONTENT', '').lower() in ('1', 'true', 'yes')
+    _sample_rate = sample_rate
+    _include_content = include_content
+
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    _queue_handler = _DeferredFormatQueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(RequestContextFilter())
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    # HTTP client internals are noise, and the app writes its own access log
+    for name in ('httpcore', 'httpx', 'urllib3', 'werkzeug'):
+        logging.getLogger(name).setLevel(max(logging.getLevelName(level), logging.WARNING))
+
+
+def shutdown_logging():
+    """Flush queued records and stop the background listener"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,90 @@
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# English text averages about four characters per token for the models we
+# run; 3.5 errs on the side of over-estimating so num_ctx is never too small
+CHARS_PER_TOKEN = 3.5
+
+# num_ctx values we allow above the floor. Ollama reloads the model whenever
+# num_ctx changes, so prompts are rounded up to one of a few sizes rather
+# than sized exactly
+CONTEXT_SIZES = (2048, 4096, 8192, 16384, 32768)
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text):
+    """Rough token count for sizing prompts"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def context_size_for(prompt_tokens, reply_tokens, max_ctx, min_ctx=CONTEXT_SIZES[0]):
+    """Smallest allowed num_ctx that fits the prompt plus the expected reply.
+
+    Everything that fits in ``min_ctx`` gets exactly ``min_ctx``, so ordinary
+    traffic always runs with one num_ctx and only long prompts change it.
+    """
+    needed = prompt_tokens + reply_tokens
+    for size in (min_ctx, *(size for size in CONTEXT_SIZES if size > min_ctx)):
+        if size >= needed or size >= max_ctx:
+            return min(size, max_ctx)
+    return max_ctx
+
+
+def _pieces(text, max_tokens):
+    """Yield paragraphs, splitting any that are too long into sentences"""
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            yield paragraph
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            # A single run-on "sentence" longer than a chunk is cut by length
+            step = int(max_tokens * CHARS_PER_TOKEN)
+            for start in range(0, len(sentence), step):
+                yield sentence[start:start + step]
+
+
+def split_into_chunks(text, max_tokens):
+    """Pack paragraphs/sentences greedily into chunks of at most max_tokens"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in _pieces(text, max_tokens):
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append('\n\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def condense(text, summarize_chunk, threshold, chunk_tokens, max_workers):
+    """Map-reduce a long journal entry into per-part summaries.
+
+    Entries at or below ``threshold`` tokens are returned unchanged. Longer
+    ones are split into chunks that are summarized concurrently with
+    ``summarize_chunk(index, total, chunk) -> (summary, tokens_used)``; the
+    summaries are joined in order so they can stand in for the entry in the
+    normal prompt templates.
+
+    Returns (text, chunk_count, tokens_used).
+    """
+    if estimate_tokens(text) <= threshold:
+        return text, 0, 0
+
+    chunks = split_into_chunks(text, chunk_tokens)
+    total = len(chunks)
+    with ThreadPoolExecutor(max_workers=min(max_workers, total)) as pool:
+        results = list(pool.map(lambda args: summarize_chunk(args[0], total, args[1]), enumerate(chunks, 1)))
+
+    summaries = [f"(Part {index} of {total}) {summary}" for index, (summary, _) in enumerate(results, 1)]
+    tokens_used = sum(tokens for _, tokens in results)
+    return '\n\n'.join(summaries), total, tokens_used
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModelsUnavailable(Exception):
+    """Raised when Ollama cannot list models and nothing is cached yet"""
+
+
+def _normalize_model(model):
+    """Turn an entry from ollama.list() into a plain JSON-serializable dict"""
+    if hasattr(model, 'model_dump'):
+        model = model.model_dump(mode='json')
+    model = dict(model)
+    # Newer ollama clients call the field 'model', older ones 'name'
+    name = model.get('name') or model.get('model')
+    model['name'] = name
+    model['model'] = model.get('model') or name
+    return model
+
+
+def fetch_ollama_models(client):
+    """Fetch the model list from Ollama and normalize it"""
+    models = client.list()
+    return [_normalize_model(model) for model in models['models']]
+
+
+class ModelListCache:
+    """In-memory model list with a TTL and stale-while-revalidate refresh.
+
+    Fresh entries are served directly. Entries past ``ttl`` but within
+    ``stale_ttl`` are served immediately while a single background thread
+    refreshes them. Older entries, and an empty cache, are refreshed inline
+    by one caller at a time; if that fails the last known list is still
+    served rather than an invented one. A failure is remembered for
+    ``error_ttl`` seconds, during which callers get the last known list (or
+    ModelsUnavailable) without asking Ollama again.
+    """
+
+    def __init__(self, fetch, ttl=30, stale_ttl=600, error_ttl=5):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.models = None
+        self.etag = None
+        self.fetched_at = 0.0
+        self.last_error = None
+        self.failed_at = None
+        self._lock = threading.Lock()
+        self._inline_lock = threading.Lock()
+        self._refreshing = False
+
+    def _store(self, models):
+        body = json.dumps(models, sort_keys=True, default=str).encode('utf-8')
+        self.models = models
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.fetched_at = time.monotonic()
+        self.last_error = None
+        self.failed_at = None
+
+    def refresh(self):
+        """Fetch from Ollama now and update the cache"""
+        try:
+            models = self.fetch()
+        except Exception as e:
+            self.last_error = str(e)
+            self.failed_at = time.monotonic()
+            logger.warning(f"Refreshing model list failed: {e}")
+            raise
+        with self._lock:
+            self._store(models)
+        return models
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _start_background_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='model-list-refresh', daemon=True).start()
+
+    def warm(self):
+        """Populate the cache in the background, logging whether Ollama answered"""
+        def run():
+            try:
+                models = self.refresh()
+                logger.info("Ollama is running with models: %s", [m['name'] for m in models])
+            except Exception:
+                logger.warning("Could not connect to Ollama; make sure it is running before making API calls")
+        threading.Thread(target=run, name='model-list-warm', daemon=True).start()
+
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+    def _recently_failed(self):
+        return self.failed_at is not None and time.monotonic() - self.failed_at < self.error_ttl
+
+    def _unavailable(self):
+        if self.models is None:
+            raise ModelsUnavailable(self.last_error or 'Model list unavailable')
+        # Last known real list beats no answer at all
+        return self.models, self.etag, False
+
+    def get(self):
+        """Return (models, etag, is_fresh), refreshing as needed"""
+        if self.models is not None:
+            age = self.age()
+            if age < self.ttl:
+                return self.models, self.etag, True
+            if age < self.ttl + self.stale_ttl:
+                self._start_background_refresh()
+                return self.models, self.etag, False
+
+        if self._recently_failed():
+            return self._unavailable()
+        # Only one caller asks Ollama; with a list cached the others serve it
+        # meanwhile, with nothing cached they wait for that caller's result
+        if not self._inline_lock.acquire(blocking=self.models is None):
+            return self.models, self.etag, False
+        try:
+            if self.models is not None and self.age() < self.ttl:
+                return self.models, self.etag, True
+            if self._recently_failed():
+                return self._unavailable()
+            try:
+                self.refresh()
+            except Exception:
+                return self._unavailable()
+            return self.models, self.etag, True
+        finally:
+            self._inline_lock.release()
+
+    def invalidate(self):
+        with self._lock:
+            self.fetched_at = 0.0
@@ -0,0 +1,161 @@
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'deepseek-r1:1.5b'
+
+# Latency samples older than this many seconds are forgotten, so a model that
+# was shifted away from gets retried once its slow samples have aged out
+LATENCY_WINDOW = 300
+# Samples needed before a p95 is trusted
+MIN_SAMPLES = 5
+
+
+class LatencyTracker:
+    """Recent generation latencies per (route, model) in this process"""
+
+    def __init__(self, window=LATENCY_WINDOW, max_samples=200):
+        self.window = window
+        self.max_samples = max_samples
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, duration_ms):
+        with self._lock:
+            samples = self.samples.setdefault(key, deque(maxlen=self.max_samples))
+            samples.append((time.monotonic(), duration_ms))
+
+    def _recent(self, key):
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            samples = self.samples.get(key)
+            if not samples:
+                return []
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            return [duration for _, duration in samples]
+
+    def percentile(self, key, pct, min_samples=MIN_SAMPLES):
+        """Latency percentile in ms, or None with too few recent samples"""
+        durations = sorted(self._recent(key))
+        if len(durations) < min_samples:
+            return None
+        return durations[min(len(durations) - 1, math.ceil(pct / 100 * len(durations)) - 1)]
+
+    def summary(self):
+        result = {}
+        for route, model in list(self.samples):
+            p50 = self.percentile((route, model), 50, 1)
+            p95 = self.percentile((route, model), 95, 1)
+            result[f"{route}|{model}"] = {
+                'samples': len(self._recent((route, model))),
+                'p50_ms': None if p50 is None else round(p50, 1),
+                'p95_ms': None if p95 is None else round(p95, 1)
+            }
+        return result
+
+
+class ModelRouter:
+    """Maps each generation task to a list of models to try in order.
+
+    Tasks are named like ``analysis``, ``advisor:therapist``, ``recipient``,
+    ``combined`` and ``summary``; a task without its own route falls back to
+    the part before the colon (``advisor``) and then to ``default``.
+    ``config`` has the shape::
+
+        {
+            "default": ["deepseek-r1:1.5b"],
+            "tasks": {
+                "recipient": ["llama3.2:1b", "deepseek-r1:1.5b"],
+                "analysis": {"models": ["deepseek-r1:7b", "deepseek-r1:1.5b"], "p95_target_ms": 20000}
+            }
+        }
+
+    Later models are fallbacks, used when an earlier one fails (e.g. it is
+    not pulled). A route with ``p95_target_ms`` is also latency-aware: a
+    model whose recent p95 in this process is over the target moves behind
+    the models that are within it, so traffic shifts to the next (faster)
+    model until the slow samples age out of the window.
+    """
+
+    def __init__(self, config=None, fatal_errors=(), latency=None):
+        config = config or {}
+        self.routes = {'default': self._parse_route(config.get('default', [DEFAULT_MODEL]))}
+        for task, route in config.get('tasks', {}).items():
+            self.routes[task] = self._parse_route(route)
+        self.fatal_errors = fatal_errors
+        self.latency = latency or LatencyTracker()
+
+    @classmethod
+    def from_env(cls, raw, **kwargs):
+        return cls(json.loads(raw) if raw else None, **kwargs)
+
+    @staticmethod
+    def _parse_route(route):
+        if isinstance(route, str):
+            route = [route]
+        if isinstance(route, list):
+            route = {'models': route}
+        if not route.get('models'):
+            raise ValueError("A model route needs at least one model")
+        return {'models': list(route['models']), 'p95_target_ms': route.get('p95_target_ms')}
+
+    def route_name(self, task):
+        """The configured route a task resolves to"""
+        for name in (task, task.split(':', 1)[0]):
+            if name in self.routes:
+                return name
+        return 'default'
+
+    def candidates(self, task):
+        """Models to try for a task, best first"""
+        name = self.route_name(task)
+        route = self.routes[name]
+        target = route['p95_target_ms']
+        if not target:
+            return list(route['models'])
+        within, over = [], []
+        for model in route['models']:
+            p95 = self.latency.percentile((name, model), 95)
+            if p95 is not None and p95 > target:
+                over.append((p95, model))
+            else:
+                within.append(model)
+        return within + [model for _, model in sorted(over)]
+
+    def primary(self, task):
+        return self.candidates(task)[0]
+
+    def call(self, task, generate):
+        """Run ``generate(model)`` with the task's models until one succeeds.
+
+        Returns (result, model). Errors listed in ``fatal_errors`` are
+        raised immediately; anything else moves on to the next model, and
+        the last error is raised when every model failed.
+        """
+        name = self.route_name(task)
+        last_error = None
+        for model in self.candidates(task):
+            started = time.perf_counter()
+            try:
+                result = generate(model)
+            except self.fatal_errors:
+                raise
+            except Exception as e:
+                last_error = e
+                logger.warning("Model %s failed for %s: %s", model, task, e)
+                continue
+            self.latency.record((name, model), (time.perf_counter() - started) * 1000)
+            return result, model
+        raise last_error
+
+    def status(self):
+        return {
+            'routes': self.routes,
+            'latency': self.latency.summary()
+        }
@@ -0,0 +1,307 @@
+import re
+
+OPEN_TAG = '<think>'
+CLOSE_TAG = '</think>'
+
+# Phrases showing a reply already greets as the advisor / addresses the recipient
+ADVISOR_GREETINGS = {
+    'therapist': ('as your therapist', 'from a therapeutic perspective', 'as a therapist'),
+    'friend': ('as your friend', 'hey', 'hi friend'),
+    'mentor': ('as your mentor', 'from a mentorship perspective'),
+    'parent': ('as your parent', 'my dear'),
+}
+RECIPIENT_GREETINGS = {
+    'self': ('personal reflection', 'note to self', 'dear self'),
+    'friend': ('dear friend', 'hey friend', 'hi friend'),
+    'partner': ('dear partner', 'my love', 'honey'),
+    'family': ('dear family', 'to my family'),
+}
+
+# Prefixes added when a reply is missing its greeting
+ADVISOR_PREFIXES = {
+    'therapist': "As your therapist, I want to acknowledge your feelings. ",
+    'friend': "Hey there, as your friend, I just want to say I'm here for you. ",
+    'mentor': "As your mentor, I see this as a growth opportunity. ",
+    'parent': "My dear, as your parent, I want you to know I care. ",
+}
+RECIPIENT_PREFIXES = {
+    'self': "Personal reflection: ",
+    'friend': "Dear friend, ",
+    'partner': "Dear partner, ",
+    'family': "Dear family, ",
+}
+
+# Words in a free-form chat message that mark it as an advisor or sharing request
+ADVISOR_REQUEST_MARKERS = ('advisorperspective', 'therapist', 'friend', 'mentor', 'parent')
+RECIPIENT_REQUEST_MARKERS = ('recipient', 'sharing with')
+RECIPIENTS = ('self', 'friend', 'partner', 'family')
+
+
+def _trie_pattern(phrases):
+    """Prefix-factored regex alternation for a set of lowercase phrases.
+
+    The regex engine walks the trie once per position instead of retrying
+    every phrase, which is what an Aho-Corasick matcher buys over a list of
+    ``phrase in text`` scans.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        end = node.get('') is True
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 and not end else '(?:' + '|'.join(branches) + ')'
+        return body + '?' if end else body
+
+    return build(trie)
+
+
+class PhraseMatcher:
+    """Finds which of many phrases occur in a text in one left-to-right scan.
+
+    The text is lowercased once and searched with a single compiled,
+    prefix-factored alternation, which skips in C to the next position
+    where a phrase can start. As in an Aho-Corasick matcher, overlaps are
+    worked out up front: each phrase knows the shorter phrases that are its
+    prefixes and how far to step before another phrase could begin inside
+    it, so the scan never restarts one character after every match.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = tuple(sorted({phrase.lower() for phrase in phrases}))
+        self.pattern = re.compile(_trie_pattern(self.phrases))
+        self.prefixes = {
+            phrase: frozenset(other for other in self.phrases if other != phrase and phrase.startswith(other))
+            for phrase in self.phrases
+        }
+        self.resume = {phrase: self._resume_offset(phrase) for phrase in self.phrases}
+
+    def _resume_offset(self, phrase):
+        """First offset inside ``phrase`` at which another match could start"""
+        for offset in range(1, len(phrase)):
+            rest = phrase[offset:]
+            if any(other.startswith(rest) or rest.startswith(other) for other in self.phrases):
+                return offset
+        return len(phrase)
+
+    def find(self, text):
+        """Set of phrases (lowercase) present in ``text``"""
+        lowered = text.lower()
+        found = set()
+        pos = 0
+        search = self.pattern.search
+        while True:
+            match = search(lowered, pos)
+            if match is None:
+                return found
+            phrase = match.group()
+            found.add(phrase)
+            found.update(self.prefixes[phrase])
+            pos = match.start() + self.resume[phrase]
+
+
+# One matcher over every greeting phrase, used on every reply
+GREETINGS = PhraseMatcher(
+    [phrase for phrases in ADVISOR_GREETINGS.values() for phrase in phrases]
+    + [phrase for phrases in RECIPIENT_GREETINGS.values() for phrase in phrases]
+    + [f'{opener} {recipient}' for recipient in RECIPIENTS for opener in ('dear', 'to my', 'hey')]
+)
+REQUEST_MARKERS = PhraseMatcher(ADVISOR_REQUEST_MARKERS + RECIPIENT_REQUEST_MARKERS + RECIPIENTS)
+
+
+def _partial_tag(text, pos=0):
+    """Length of a trailing fragment of text[pos:] that could start a think tag"""
+    start = text.rfind('<', max(len(text) - len(CLOSE_TAG) + 1, pos))
+    if start < 0:
+        return 0
+    tail = text[start:]
+    return len(tail) if OPEN_TAG.startswith(tail) or CLOSE_TAG.startswith(tail) else 0
+
+
+class ReasoningStripper:
+    """Removes deepseek-r1 ``<think>...</think>`` blocks from text fed in chunks.
+
+    Works the same on a whole reply (``feed`` it once, then ``finish``) and
+    on a token stream, where a tag may be split across chunks: a trailing
+    fragment that could start a tag is held back until the next chunk.
+    Leading and trailing whitespace of the visible text is dropped. Like the
+    original regex clean-up, a stray ``</think>`` is removed on its own and
+    an unclosed ``<think>`` only loses the tag.
+    """
+
+    def __init__(self):
+        self.in_think = False
+        self.pending = ''
+        self.block = []
+        self.started = False
+        self.held_space = ''
+
+    def _visible(self, text):
+        """Emit visible text, trimming leading space and holding trailing space"""
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return ''
+            self.started = True
+        text = self.held_space + text
+        stripped = text.rstrip()
+        self.held_space = text[len(stripped):]
+        return stripped
+
+    def feed(self, chunk):
+        if not self.pending and '<' not in chunk:
+            # Most stream tokens: nothing that could touch a tag
+            if self.in_think:
+                self.block.append(chunk)
+                return ''
+            return self._visible(chunk)
+        text = self.pending + chunk
+        self.pending = ''
+        out = []
+        pos = 0
+        find = text.find
+        while True:
+            if self.in_think:
+                end = find(CLOSE_TAG, pos)
+                if end < 0:
+                    keep = _partial_tag(text, pos)
+                    self.block.append(text[pos:len(text) - keep])
+                    self.pending = text[len(text) - keep:]
+                    break
+                self.block = []
+                self.in_think = False
+                pos = end + len(CLOSE_TAG)
+                continue
+            start = find('<', pos)
+            if start < 0:
+                out.append(text[pos:])
+                break
+            if text.startswith(OPEN_TAG, start):
+                out.append(text[pos:start])
+                self.in_think = True
+                pos = start + len(OPEN_TAG)
+            elif text.startswith(CLOSE_TAG, start):
+                out.append(text[pos:start])
+                pos = start + len(CLOSE_TAG)
+            elif _partial_tag(text, start) == len(text) - start:
+                out.append(text[pos:start])
+                self.pending = text[start:]
+                break
+            else:
+                out.append(text[pos:start + 1])
+                pos = start + 1
+        return self._visible(''.join(out))
+
+    def finish(self):
+        """Flush what is left at the end of the reply"""
+        rest = self.pending
+        if self.in_think:
+            # Never closed: keep the text minus any tags, as the original clean-up did
+            rest = (''.join(self.block) + rest).replace(OPEN_TAG, '').replace(CLOSE_TAG, '')
+            self.block = []
+            self.in_think = False
+        self.pending = ''
+        text = self._visible(rest) if rest else ''
+        self.held_space = ''
+        return text
+
+
+def clean_think_tags(text):
+    """Remove <think> tags and their content from LLM responses"""
+    stripper = ReasoningStripper()
+    return stripper.feed(text) + stripper.finish()
+
+
+def _prefix_recipient(text, recipient, found):
+    if recipient in RECIPIENT_GREETINGS and not found.intersection(RECIPIENT_GREETINGS[recipient]):
+        return RECIPIENT_PREFIXES[recipient] + text
+    return text
+
+
+def recipient_greeting(text, recipient, found=None):
+    """Add the recipient's greeting to a reformatted entry that lacks one"""
+    return _prefix_recipient(text, recipient, GREETINGS.find(text) if found is None else found)
+
+
+def combined_greeting(text, recipient, found=None):
+    """Make sure advice formatted for sharing is addressed to the recipient"""
+    openers = [f'{opener} {recipient.lower()}' for opener in ('dear', 'to my', 'hey')]
+    if recipient.lower() in RECIPIENTS:
+        found = GREETINGS.find(text) if found is None else found
+        present = found.intersection(openers)
+    else:
+        lowered = text.lower()
+        present = any(opener in lowered for opener in openers)
+    if present:
+        return text
+    greeting = "Personal reflection: " if recipient == "self" else f"Dear {recipient}, "
+    return greeting + text
+
+
+def chat_greeting(message, text, found=None):
+    """Format a free-form chat reply if the model didn't follow the requested format.
+
+    The message is checked for advisor and recipient keywords; for each one
+    mentioned, the reply gets that role's prefix if it has none of its
+    greeting phrases.
+    """
+    markers = REQUEST_MARKERS.find(message)
+    if not markers:
+        return text
+    found = GREETINGS.find(text) if found is None else found
+    if markers.intersection(ADVISOR_REQUEST_MARKERS):
+        for advisor in ADVISOR_GREETINGS:
+            if advisor in markers and not found.intersection(ADVISOR_GREETINGS[advisor]):
+                return ADVISOR_PREFIXES[advisor] + text
+    if markers.intersection(RECIPIENT_REQUEST_MARKERS):
+        for recipient in RECIPIENTS:
+            if recipient in markers and not found.intersection(RECIPIENT_GREETINGS[recipient]):
+                return RECIPIENT_PREFIXES[recipient] + text
+    return text
+
+
+class ReplyStream:
+    """Post-processes a streamed reply chunk by chunk.
+
+    Reasoning is stripped as it arrives. The first ``head_chars`` visible
+    characters are held back so ``format_head(head)`` (e.g. adding a missing
+    greeting) can run on them before anything is sent; after that chunks
+    pass straight through. ``text`` accumulates everything emitted.
+    """
+
+    def __init__(self, format_head=None, head_chars=200):
+        self.stripper = ReasoningStripper()
+        self.format_head = format_head
+        self.head_chars = head_chars
+        self.head = [] if format_head else None
+        self.head_len = 0
+        self.parts = []
+
+    def _emit(self, visible, final=False):
+        if self.head is not None:
+            self.head.append(visible)
+            self.head_len += len(visible)
+            if self.head_len < self.head_chars and not final:
+                return ''
+            visible = self.format_head(''.join(self.head))
+            self.head = None
+        self.parts.append(visible)
+        return visible
+
+    def feed(self, chunk):
+        visible = self.stripper.feed(chunk)
+        # Most chunks inside a <think> block yield nothing to emit
+        return self._emit(visible) if visible else ''
+
+    def finish(self):
+        return self._emit(self.stripper.finish(), final=True)
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
@@ -0,0 +1,31 @@
+# Prompts shared by the web app and reanalyze.py, so batch results match /api/analyze
+
+# System prompt for summarizing parts of long journal entries
+SUMMARY_SYSTEM_PROMPT = """You condense part of a personal journal entry so it can be responded to later.
+Write in first person, in the writer's own voice.
+Keep the emotions, the events that caused them, and any worries, hopes or questions the writer raises.
+Do not add advice, analysis or greetings."""
+
+
+def summary_prompts(index, total, chunk):
+    """System prompt and user message for summarizing one part of a long entry"""
+    user_message = f"""This is part {index} of {total} of a long journal entry:
+"{chunk}"
+
+Summarize this part in 3-5 sentences."""
+    return SUMMARY_SYSTEM_PROMPT, user_message
+
+
+def analysis_prompts(entry_text, emotion, intensity):
+    """System prompt and user message for analyzing a journal entry"""
+    system_prompt = f"""You are an empathetic and insightful AI assistant analyzing a journal entry.
+Your task is to provide a thoughtful analysis of the writer's emotions and thoughts.
+The journal entry is about feeling {emotion} with intensity level {intensity} (on a scale of 1-5).
+Focus on providing validation, insight, and gentle observations about patterns in the text.
+Keep your response to 3-4 sentences, written in second person (addressing the writer directly)."""
+
+    user_message = f"""The user has written a journal entry about feeling {emotion} with intensity level {intensity} (on a scale of 1-5). 
+Here's their entry: "{entry_text}"
+
+Provide an empathetic and insightful analysis of their emotions and thoughts. Focus on validation, insight, and gentle observations."""
+    return system_prompt, user_message
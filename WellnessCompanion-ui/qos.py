@@ -0,0 +1,123 @@
+import json
+import logging
+import threading
+import time
+
+from model_router import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+# Degradation levels, mildest first. ``enter`` is the pressure at which a
+# level starts; a level may cap num_predict, turn reasoning off (think),
+# switch routed generations to a smaller model, or serve fallbacks only.
+# Capping num_predict always turns reasoning off too: deepseek-r1 can spend
+# the whole budget inside <think>, leaving only its reasoning as the reply.
+DEFAULT_LEVELS = [
+    {'name': 'normal'},
+    {'name': 'short', 'enter': 1.0, 'num_predict': 1024, 'think': False},
+    {'name': 'no-reasoning', 'enter': 1.5, 'num_predict': 384, 'think': False},
+    {'name': 'small-model', 'enter': 2.0, 'num_predict': 256, 'think': False, 'model': None},
+    {'name': 'fallback', 'enter': 3.0, 'fallback': True},
+]
+
+
+class Overloaded(Exception):
+    """Raised instead of calling the LLM while the QoS level serves fallbacks only"""
+
+
+class QoSController:
+    """Chooses how much to degrade new generations from the load on this process.
+
+    Pressure is the larger of in-flight generations / ``queue_target`` and
+    the recent p95 upstream latency / ``latency_target_ms``. Rising pressure
+    moves straight up to the highest level whose ``enter`` it reaches.
+    Recovery is one level at a time, and only after pressure has stayed
+    below ``exit_ratio`` times the current level's ``enter`` for ``hold``
+    seconds, so the level does not flap around a threshold.
+    """
+
+    def __init__(self, levels=None, inflight=lambda: 0, queue_target=4, latency_target_ms=30000,
+                 exit_ratio=0.7, hold=30, window=60):
+        self.levels = levels or DEFAULT_LEVELS
+        self.inflight = inflight
+        self.queue_target = queue_target
+        self.latency_target_ms = latency_target_ms
+        self.exit_ratio = exit_ratio
+        self.hold = hold
+        self.latency = LatencyTracker(window=window)
+        self.index = 0
+        self.calm_since = None
+        self.changed_at = time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, raw, small_model='', **kwargs):
+        """Build from QOS_LEVELS JSON (a list of levels; empty means DEFAULT_LEVELS)"""
+        levels = json.loads(raw) if raw else [dict(level) for level in DEFAULT_LEVELS]
+        for index, level in enumerate(levels):
+            if not isinstance(level, dict):
+                raise ValueError(f"QOS_LEVELS level {index} must be an object")
+            enter = level.get('enter')
+            # The first level is the normal one; every other level needs the pressure it starts at
+            if index and (not isinstance(enter, (int, float)) or isinstance(enter, bool)):
+                raise ValueError(f"QOS_LEVELS level {level.get('name', index)!r} needs a numeric 'enter'")
+        for level in levels:
+            if level.get('num_predict'):
+                level['think'] = False
+            if 'model' in level and not level['model']:
+                level.pop('model')
+                if small_model:
+                    level['model'] = small_model
+        if any(levels[i]['enter'] >= levels[i + 1]['enter'] for i in range(1, len(levels) - 1)):
+            raise ValueError("QOS_LEVELS must be ordered by increasing 'enter'")
+        return cls(levels, **kwargs)
+
+    def record_latency(self, duration_ms):
+        self.latency.record('upstream', duration_ms)
+
+    def pressure(self):
+        pressure = self.inflight() / self.queue_target
+        p95 = self.latency.percentile('upstream', 95)
+        if p95 is not None:
+            pressure = max(pressure, p95 / self.latency_target_ms)
+        return pressure
+
+    def level(self):
+        """Level for a generation starting now (also advances the controller)"""
+        pressure = self.pressure()
+        now = time.monotonic()
+        with self._lock:
+            previous = self.index
+            target = 0
+            for index, level in enumerate(self.levels[1:], 1):
+                if pressure >= level['enter']:
+                    target = index
+            if target > self.index:
+                self.index = target
+                self.calm_since = None
+            elif self.index and pressure < self.levels[self.index]['enter'] * self.exit_ratio:
+                if self.calm_since is None:
+                    self.calm_since = now
+                elif now - self.calm_since >= self.hold:
+                    # Each further step down needs its own calm period
+                    self.index -= 1
+                    self.calm_since = now
+            else:
+                self.calm_since = None
+            level = self.levels[self.index]
+            if self.index != previous:
+                self.changed_at = time.time()
+                logger.warning("QoS level %s -> %s (pressure %.2f)",
+                               self.levels[previous]['name'], level['name'], pressure)
+        return level
+
+    def status(self):
+        p95 = self.latency.percentile('upstream', 95)
+        return {
+            'level': self.levels[self.index]['name'],
+            'pressure': round(self.pressure(), 2),
+            'inflight': self.inflight(),
+            'p95_ms': None if p95 is None else round(p95, 1),
+            'since': self.changed_at,
+            'levels': self.levels
+        }
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import math
+import time
+
+# Used for any route/client without a more specific entry in RATE_LIMITS
+DEFAULT_LIMITS = {
+    'capacity': 20000,        # tokens a client can burst
+    'refill_per_sec': 20,     # tokens restored per second
+    'on_exhausted': 'reject'  # 'reject' (429) or 'fallback' (canned response, no LLM call)
+}
+
+
+class QuotaExceeded(Exception):
+    """Raised instead of calling Ollama when a client is out of budget"""
+
+
+class TokenBucketLimiter:
+    """Per-client, per-route token buckets charged by LLM tokens processed.
+
+    A request is admitted while the client's bucket is positive; once it has
+    run, the bucket is debited by the prompt and eval tokens Ollama actually
+    processed, so a long generation can push the balance below zero and the
+    client then waits for it to refill. Buckets live in SharedState so limits
+    hold across worker processes.
+
+    ``config`` has the shape::
+
+        {
+            "default": {"capacity": 20000, "refill_per_sec": 20, "on_exhausted": "reject"},
+            "routes": {"/api/chat": {"capacity": 8000, "refill_per_sec": 5}},
+            "keys": {"<api key>": {"capacity": 100000, "refill_per_sec": 100}}
+        }
+
+    Key entries override route entries, which override the default. Only
+    keys listed there get a bucket of their own; any other X-API-Key is
+    charged to the caller's address, so rotating the header gains nothing.
+    Buckets that have refilled completely are purged every
+    ``purge_interval`` seconds, since a missing bucket starts full anyway.
+    """
+
+    def __init__(self, state, config=None, purge_interval=300):
+        self.state = state
+        config = config or {}
+        self.default = dict(DEFAULT_LIMITS, **config.get('default', {}))
+        self.routes = config.get('routes', {})
+        self.keys = {self.hash_key(key): limits for key, limits in config.get('keys', {}).items()}
+        self.purge_interval = purge_interval
+        self.purged_at = time.time()
+        with self.state.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    @classmethod
+    def from_env(cls, state, raw):
+        return cls(state, json.loads(raw) if raw else None)
+
+    @staticmethod
+    def hash_key(api_key):
+        return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    def client_id(self, api_key, remote_addr):
+        if api_key and self.hash_key(api_key) in self.keys:
+            return f"key:{self.hash_key(api_key)}"
+        return f"ip:{remote_addr}"
+
+    def limits_for(self, client, route):
+        limits = dict(self.default)
+        limits.update(self.routes.get(route, {}))
+        if client.startswith('key:'):
+            limits.update(self.keys.get(client[len('key:'):], {}))
+        return limits
+
+    def _update(self, bucket, limits, cost):
+        """Refill the bucket for elapsed time, subtract ``cost``, return the balance"""
+        now = time.time()
+        with self.state.transaction() as db:
+            row = db.execute("SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (bucket,)).fetchone()
+            tokens = limits['capacity'] if row is None else row[0]
+            if row is not None:
+                tokens = min(limits['capacity'], tokens + (now - row[1]) * limits['refill_per_sec'])
+            tokens -= cost
+            db.execute(
+                "INSERT INTO token_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (bucket, tokens, now)
+            )
+        if now - self.purged_at >= self.purge_interval:
+            self.purge_idle(now)
+        return tokens
+
+    def purge_idle(self, now=None):
+        """Delete buckets that are full again under every configured limit"""
+        now = now or time.time()
+        self.purged_at = now
+        configured = [self.default, *self.routes.values(), *self.keys.values()]
+        refill = min(limits.get('refill_per_sec', self.default['refill_per_sec']) for limits in configured)
+        capacity = max(limits.get('capacity', self.default['capacity']) for limits in configured)
+        if refill <= 0:
+            # A bucket that never refills must be kept to stay exhausted
+            return
+        self.state.execute(
+            "DELETE FROM token_buckets WHERE tokens + (? - updated_at) * ? >= ?",
+            (now, refill, capacity)
+        )
+
+    def check(self, client, route):
+        """Return a decision dict for admitting a request; does not charge"""
+        limits = self.limits_for(client, route)
+        tokens = self._update(f"{client}|{route}", limits, 0)
+        return self._decision(tokens, limits)
+
+    def charge(self, client, route, tokens_used):
+        """Debit the tokens a finished request consumed"""
+        limits = self.limits_for(client, route)
+        tokens = self._update(f"{client}|{route}", limits, tokens_used)
+        return self._decision(tokens, limits)
+
+    def _decision(self, tokens, limits):
+        refill = limits['refill_per_sec']
+        return {
+            'allowed': tokens > 0,
+            'remaining': max(int(tokens), 0),
+            'limit': int(limits['capacity']),
+            'retry_after': 0 if tokens > 0 else math.ceil((1 - tokens) / refill) if refill else None,
+            'reset': math.ceil((limits['capacity'] - tokens) / refill) if refill else None,
+            'on_exhausted': limits['on_exhausted']
+        }
+
+    @staticmethod
+    def headers(decision):
+        headers = {
+            'X-RateLimit-Limit': str(decision['limit']),
+            'X-RateLimit-Remaining': str(decision['remaining']),
+        }
+        if decision['reset'] is not None:
+            headers['X-RateLimit-Reset'] = str(decision['reset'])
+        if not decision['allowed'] and decision['retry_after'] is not None:
+            headers['Retry-After'] = str(decision['retry_after'])
+        return headers
@@ -0,0 +1,383 @@
+"""Regenerate aiSummary for stored journal entries in bulk.
+
+Streams entries from the journal database and runs many analyses at once
+against one or more Ollama servers, writing results back in batches. Use it
+after changing the analysis prompt or model instead of replaying entries
+through the HTTP API one at a time.
+
+    python reanalyze.py --version 2025-06-prompt-v2
+    python reanalyze.py --version v2 --backends http://gpu1:11434,http://gpu2:11434 --concurrency auto
+
+Entries whose stored analysis_version already equals --version are skipped,
+so re-running the same command continues where it left off. Progress is also
+checkpointed with every batch written (job name = --version unless --job is
+given), which lets --force runs resume after a crash too.
+
+Each Ollama server only generates OLLAMA_NUM_PARALLEL requests at once and
+queues the rest, so --concurrency should be about that number per backend;
+--concurrency auto finds it by raising concurrency while throughput improves.
+"""
+import argparse
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from journal_store import JournalStore
+from long_input import condense, context_size_for, estimate_tokens
+from model_router import ModelRouter
+from postprocess import clean_think_tags
+from prompts import analysis_prompts, summary_prompts
+from shared_state import SharedState
+
+logger = logging.getLogger('reanalyze')
+
+
+class Backend:
+    """One Ollama server with its own HTTP client"""
+
+    def __init__(self, host):
+        import ollama
+        self.host = host
+        self.client = ollama.Client(host=host) if host else ollama.Client()
+
+    def __repr__(self):
+        return self.host or 'default'
+
+
+class SlotPool:
+    """Generation slots across backends; taking a slot blocks when all are busy.
+
+    A slot is returned to the pool when its generation finishes, so faster
+    backends naturally get more of the work. Concurrency can be raised or
+    lowered while running.
+    """
+
+    def __init__(self, backends, per_backend):
+        self.backends = backends
+        self.per_backend = 0
+        self._slots = queue.Queue()
+        self._retire = 0
+        self._lock = threading.Lock()
+        self.resize(per_backend)
+
+    def resize(self, per_backend):
+        with self._lock:
+            change = per_backend - self.per_backend
+            self.per_backend = per_backend
+            if change < 0:
+                self._retire += -change * len(self.backends)
+        for _ in range(max(change, 0)):
+            for backend in self.backends:
+                self._slots.put(backend)
+
+    @property
+    def total(self):
+        return self.per_backend * len(self.backends)
+
+    def take(self):
+        return self._slots.get()
+
+    def give_back(self, backend):
+        with self._lock:
+            if self._retire:
+                self._retire -= 1
+                return
+        self._slots.put(backend)
+
+
+class ConcurrencyTuner:
+    """Hill-climbs per-backend concurrency to the point where throughput stops rising.
+
+    After each measurement window the concurrency is doubled while entries
+    per second improve by at least ``min_gain``; the first doubling that does
+    not pay off is undone and tuning stops.
+    """
+
+    def __init__(self, slots, max_per_backend, min_gain=0.1):
+        self.slots = slots
+        self.max_per_backend = max_per_backend
+        self.min_gain = min_gain
+        self.best_rate = None
+        self.previous = None
+        self.done = False
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.warmup = 0
+
+    def record(self):
+        if self.done:
+            return
+        if self.warmup:
+            # Generations started before a resize would blur the measurement
+            self.warmup -= 1
+            if not self.warmup:
+                self.window_start = time.monotonic()
+            return
+        self.window_count += 1
+        # Measure over a few rounds of the current concurrency
+        if self.window_count < max(3 * self.slots.total, 8):
+            return
+        rate = self.window_count / (time.monotonic() - self.window_start)
+        current = self.slots.per_backend
+        if self.best_rate is None or rate >= self.best_rate * (1 + self.min_gain):
+            self.best_rate = rate
+            self.previous = current
+            if current * 2 > self.max_per_backend:
+                self.done = True
+            else:
+                self.slots.resize(current * 2)
+        else:
+            self.slots.resize(self.previous)
+            self.done = True
+        if self.done:
+            logger.info("Concurrency tuned to %s per backend (%.2f entries/s)", self.slots.per_backend, self.best_rate)
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.warmup = self.slots.total
+
+
+def chat(backend, model, system_prompt, user_message, temperature, num_predict=None):
+    """One system + user generation on ``backend``; returns the cleaned reply"""
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message)
+    options = {
+        'temperature': temperature,
+        'num_ctx': context_size_for(
+            prompt_tokens, settings.REPLY_TOKEN_BUDGET, settings.MAX_NUM_CTX, settings.MIN_NUM_CTX
+        )
+    }
+    if num_predict:
+        options['num_predict'] = num_predict
+    response = backend.client.chat(
+        model=model,
+        messages=[
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_message}
+        ],
+        options=options
+    )
+    return clean_think_tags(response['message']['content'])
+
+
+def analyze(backend, model, summary_model, entry, num_predict):
+    """Generate the analysis for one entry the way /api/analyze does.
+
+    Long entries are summarized in parts first, one part at a time on the
+    same backend, so they are not cut off at MAX_NUM_CTX.
+    """
+    emotion = entry['emotion'] or {}
+
+    def summarize_chunk(index, total, chunk):
+        system_prompt, user_message = summary_prompts(index, total, chunk)
+        return chat(backend, summary_model, system_prompt, user_message, 0.3), 0
+
+    entry_text, _, _ = condense(
+        entry['content'],
+        summarize_chunk,
+        settings.LONG_INPUT_THRESHOLD,
+        settings.LONG_INPUT_CHUNK_TOKENS,
+        # One generation per slot; the other slots keep the backend busy
+        1
+    )
+    system_prompt, user_message = analysis_prompts(entry_text, emotion.get('name', ''), emotion.get('intensity', 3))
+    return chat(backend, model, system_prompt, user_message, 0.7, num_predict)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '--:--'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class Progress:
+    """Entries per second (over the last minute) and ETA"""
+
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.recent = deque()
+
+    def record(self, ok):
+        now = time.monotonic()
+        self.done += 1
+        self.failed += 0 if ok else 1
+        self.recent.append(now)
+        while self.recent and self.recent[0] < now - 60:
+            self.recent.popleft()
+
+    def rate(self):
+        span = min(time.monotonic() - self.started, 60)
+        return len(self.recent) / span if span > 0 else 0.0
+
+    def line(self, concurrency):
+        rate = self.rate()
+        remaining = max(self.total - self.done, 0)
+        eta = remaining / rate if rate else None
+        return (f"{self.done}/{self.total} entries, {self.failed} failed, {rate:.2f} entries/s, "
+                f"ETA {format_duration(eta)}, concurrency {concurrency}")
+
+    def maybe_report(self, concurrency):
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(self.line(concurrency), file=sys.stderr, flush=True)
+
+
+def run(store, backends, model, summary_model, version, job, per_backend=4, tune=False, max_per_backend=32,
+        batch_size=50, commit_interval=5.0, user_id=None, force=False, limit=None,
+        num_predict=None, retries=1, report_interval=10.0):
+    """Re-analyze pending entries; returns the Progress of the run"""
+    checkpoint = store.checkpoint(job) or {'last_id': '', 'last_user': '', 'done': 0, 'failed': 0}
+    # Entry ids are only unique per user, so progress is an (id, user_id) key
+    after = (checkpoint['last_id'], checkpoint['last_user'])
+    if checkpoint['last_id']:
+        print(f"Resuming job {job} after entry {checkpoint['last_id']} of {checkpoint['last_user']} "
+              f"({checkpoint['done']} done before)", file=sys.stderr)
+    total = store.count_pending(version, after, user_id, force)
+    if limit:
+        total = min(total, limit)
+    progress = Progress(total, report_interval)
+    print(f"{total} entries to analyze with {model} on {len(backends)} backend(s)", file=sys.stderr)
+
+    slots = SlotPool(backends, 1 if tune else per_backend)
+    tuner = ConcurrencyTuner(slots, max_per_backend) if tune else None
+    finished = queue.Queue()
+
+    def work(backend, entry):
+        try:
+            attempt = 0
+            while True:
+                try:
+                    summary = analyze(backend, model, summary_model, entry, num_predict)
+                    finished.put(((entry['id'], entry['user_id']), summary, None))
+                    return
+                except Exception as e:
+                    attempt += 1
+                    if attempt > retries:
+                        finished.put(((entry['id'], entry['user_id']), None, e))
+                        return
+                    time.sleep(min(2 ** attempt, 30))
+        finally:
+            slots.give_back(backend)
+
+    # Keys in submission order; the checkpoint only moves past a key once it
+    # and every key before it have finished
+    submitted = deque()
+    completed = {}
+    pending_writes = []
+    state = {'last': after, 'last_commit': time.monotonic()}
+
+    def collect(block=False):
+        while True:
+            try:
+                key, summary, error = finished.get(block=block, timeout=1 if block else None)
+            except queue.Empty:
+                return
+            block = False
+            completed[key] = error is None
+            progress.record(error is None)
+            if tuner:
+                tuner.record()
+            if error is None:
+                pending_writes.append((key[1], key[0], summary, model))
+            else:
+                logger.warning("Analysis failed for entry %s of %s: %s", key[0], key[1], error)
+
+    def flush(force_write=False):
+        while submitted and submitted[0] in completed:
+            state['last'] = submitted.popleft()
+            completed.pop(state['last'])
+        due = len(pending_writes) >= batch_size or time.monotonic() - state['last_commit'] >= commit_interval
+        if not (force_write or due):
+            return
+        store.save_analyses(pending_writes, version, job, {
+            'last_id': state['last'][0],
+            'last_user': state['last'][1],
+            'done': checkpoint['done'] + progress.done - progress.failed,
+            'failed': checkpoint['failed'] + progress.failed
+        })
+        pending_writes.clear()
+        state['last_commit'] = time.monotonic()
+
+    max_workers = max_per_backend * len(backends) if tune else per_backend * len(backends)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='reanalyze') as pool:
+        for count, entry in enumerate(store.iter_pending(version, after, user_id, force)):
+            if limit and count >= limit:
+                break
+            backend = slots.take()
+            submitted.append((entry['id'], entry['user_id']))
+            pool.submit(work, backend, entry)
+            collect()
+            flush()
+            progress.maybe_report(slots.total)
+        while submitted:
+            collect(block=True)
+            flush()
+            progress.maybe_report(slots.total)
+    flush(force_write=True)
+    print(progress.line(slots.total), file=sys.stderr)
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate aiSummary for stored journal entries")
+    parser.add_argument('--version', required=True, help="label stored with each new analysis, e.g. the prompt revision")
+    parser.add_argument('--model', help="model to use (default: the 'analysis' route)")
+    parser.add_argument('--summary-model', help="model for summarizing long entries (default: the 'summary' route)")
+    parser.add_argument('--backends', default='', help="comma-separated Ollama URLs (default: OLLAMA_HOST)")
+    parser.add_argument('--concurrency', default='4', help="generations per backend, or 'auto'")
+    parser.add_argument('--max-concurrency', type=int, default=32, help="upper bound for --concurrency auto")
+    parser.add_argument('--batch-size', type=int, default=50, help="results written per transaction")
+    parser.add_argument('--user', help="only this user's entries")
+    parser.add_argument('--limit', type=int, help="stop after this many entries")
+    parser.add_argument('--force', action='store_true', help="also redo entries already at --version")
+    parser.add_argument('--job', help="checkpoint name (default: the version)")
+    parser.add_argument('--restart', action='store_true', help="ignore an existing checkpoint")
+    parser.add_argument('--num-predict', type=int, help="cap on generated tokens per entry")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    store = JournalStore(SharedState(settings.JOURNAL_PATH))
+    router = ModelRouter.from_env(settings.MODEL_ROUTES)
+    job = args.job or args.version
+    if args.restart:
+        store.clear_checkpoint(job)
+    backends = [Backend(host.strip()) for host in args.backends.split(',') if host.strip()] or [Backend(None)]
+    tune = args.concurrency == 'auto'
+    progress = run(
+        store,
+        backends,
+        args.model or router.primary('analysis'),
+        args.summary_model or router.primary('summary'),
+        args.version,
+        job,
+        per_backend=1 if tune else int(args.concurrency),
+        tune=tune,
+        max_per_backend=args.max_concurrency,
+        batch_size=args.batch_size,
+        user_id=args.user,
+        force=args.force,
+        limit=args.limit,
+        num_predict=args.num_predict,
+        report_interval=args.report_interval
+    )
+    if not args.limit:
+        # Ran to the end; entries that failed still lack --version, so a
+        # later run picks them up again from the start
+        store.clear_checkpoint(job)
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
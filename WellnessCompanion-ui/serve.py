@@ -0,0 +1,116 @@
+"""Production server for the WellnessCompanion backend.
+
+Run with ``python serve.py`` or ``SERVER_MODE=production python app.py``.
+Uses gunicorn with several worker processes, each running a pool of
+threads (or gevent greenlets). On Windows, where gunicorn is unavailable,
+it falls back to waitress in a single process.
+
+Settings (environment variables):
+    HOST, PORT          listen address (0.0.0.0:5000)
+    WEB_CONCURRENCY     worker processes (2)
+    THREADS             threads per worker (8)
+    WORKER_CLASS        gthread or gevent (gthread)
+    WORKER_CONNECTIONS  concurrent greenlets per gevent worker (100)
+    TIMEOUT             seconds before a silent worker is restarted (300)
+    GRACEFUL_TIMEOUT    seconds to drain in-flight generations on shutdown (120)
+    KEEPALIVE           seconds to hold idle keep-alive connections (5)
+    MAX_REQUESTS        recycle a worker after this many requests, 0 = never (0)
+"""
+import logging
+import os
+import sys
+
+logger = logging.getLogger('serve')
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def gunicorn_options():
+    """Gunicorn settings built from the environment"""
+    worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+    options = {
+        'bind': f"{os.environ.get('HOST', '0.0.0.0')}:{env_int('PORT', 5000)}",
+        'workers': env_int('WEB_CONCURRENCY', 2),
+        'worker_class': worker_class,
+        'timeout': env_int('TIMEOUT', 300),
+        'graceful_timeout': env_int('GRACEFUL_TIMEOUT', 120),
+        'keepalive': env_int('KEEPALIVE', 5),
+        'max_requests': env_int('MAX_REQUESTS', 0),
+        'max_requests_jitter': env_int('MAX_REQUESTS', 0) // 10,
+        # Each worker imports the app itself, so background threads (log
+        # listener, cache refresh) are started after fork
+        'preload_app': False,
+        'accesslog': None,
+        'post_worker_init': post_worker_init,
+        'worker_int': worker_int,
+        'worker_exit': worker_exit,
+    }
+    if worker_class == 'gthread':
+        options['threads'] = env_int('THREADS', 8)
+    else:
+        options['worker_connections'] = env_int('WORKER_CONNECTIONS', 100)
+    return options
+
+
+def post_worker_init(worker):
+    """Probe Ollama in the background once the worker is ready to serve"""
+    import app
+    app.model_cache.warm()
+
+
+def worker_int(worker):
+    import app
+    logger.warning("Worker %s interrupted with %s generations in flight", os.getpid(), app.inflight_generations)
+
+
+def worker_exit(server, worker):
+    import app
+    from log_config import shutdown_logging
+    if app.inflight_generations:
+        logger.warning("Worker %s exiting with %s generations still in flight", os.getpid(), app.inflight_generations)
+    shutdown_logging()
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class WellnessApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    WellnessApplication(gunicorn_options()).run()
+
+
+def run_waitress():
+    from waitress import serve
+    import app
+    app.model_cache.warm()
+    serve(
+        app.app,
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=env_int('PORT', 5000),
+        threads=env_int('THREADS', 8),
+        channel_timeout=env_int('TIMEOUT', 300)
+    )
+
+
+def main():
+    if sys.platform == 'win32':
+        run_waitress()
+    else:
+        run_gunicorn()
+
+
+if __name__ == "__main__":
+    main()
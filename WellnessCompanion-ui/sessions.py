@@ -0,0 +1,107 @@
+import json
+import time
+import uuid
+
+
+class SessionNotFound(Exception):
+    """Raised for unknown or expired session ids"""
+
+
+class SessionStore:
+    """Multi-turn conversation histories shared by all worker processes.
+
+    Each session keeps the system prompt, the opening exchange and the most
+    recent turns. Sessions idle for longer than ``idle_ttl`` seconds are
+    dropped, and when more than ``max_sessions`` exist the least recently
+    used ones are evicted.
+
+    Follow-ups resend the stored history unchanged, so Ollama finds the
+    earlier turns already in its KV cache and only evaluates the latest
+    reply and the new message. That only works while the model stays loaded
+    with the same num_ctx, which is why a session pins its num_ctx and only
+    ever grows it.
+    """
+
+    def __init__(self, state, idle_ttl=1800, max_sessions=1000, max_turns=10, max_chars=24000):
+        self.state = state
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        with self.state.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def create(self, model, messages, num_ctx):
+        """Start a session from an initial message list (system prompt first)"""
+        session = {
+            'id': uuid.uuid4().hex,
+            'model': model,
+            'num_ctx': num_ctx,
+            'messages': self._trim(messages),
+            'created_at': time.time(),
+        }
+        now = time.time()
+        with self.state.transaction() as db:
+            db.execute("DELETE FROM sessions WHERE updated_at <= ?", (now - self.idle_ttl,))
+            db.execute(
+                "INSERT INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session['id'], json.dumps(session), now)
+            )
+            db.execute(
+                "DELETE FROM sessions WHERE id IN "
+                "(SELECT id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            )
+        return session
+
+    def get(self, session_id):
+        row = self.state.execute(
+            "SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or row[1] <= time.time() - self.idle_ttl:
+            raise SessionNotFound(session_id)
+        return json.loads(row[0])
+
+    def append(self, session_id, new_messages, num_ctx=None):
+        """Add messages to a session's history and refresh its idle timer"""
+        with self.state.transaction() as db:
+            row = db.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                raise SessionNotFound(session_id)
+            session = json.loads(row[0])
+            session['messages'] = self._trim(session['messages'] + list(new_messages))
+            if num_ctx:
+                session['num_ctx'] = max(session['num_ctx'], num_ctx)
+            db.execute(
+                "UPDATE sessions SET data = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(session), time.time(), session_id)
+            )
+        return session
+
+    def delete(self, session_id):
+        with self.state.transaction() as db:
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _trim(self, messages):
+        """Keep the system prompt, the opening exchange and the latest turns.
+
+        Dropping turns changes the prompt prefix and costs one full
+        re-evaluation, so when the history is over its limit half of the
+        later turns are dropped at once rather than one per follow-up. The
+        opening exchange (the journal entry and first reply) is always kept
+        because every follow-up refers to it.
+        """
+        head = [m for m in messages[:1] if m['role'] == 'system']
+        rest = messages[len(head):]
+        opening, turns = rest[:2], rest[2:]
+        max_turn_messages = 2 * max(self.max_turns - 1, 0)
+        if len(turns) > max_turn_messages:
+            keep = (max_turn_messages // 2) & ~1
+            turns = turns[len(turns) - keep:] if keep else []
+        while turns and sum(len(m['content']) for m in head + opening + turns) > self.max_chars:
+            turns = turns[2:]
+        return head + opening + turns
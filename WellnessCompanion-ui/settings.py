@@ -0,0 +1,31 @@
+"""Settings shared by the web app and the command-line tools.
+
+Importing this module only reads the environment (and .env), so tools such
+as reanalyze.py can use the same paths and limits without building the app.
+"""
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# SQLite file holding the server-side copy of journal entries
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', os.path.join(BASE_DIR, 'data', 'journal.db'))
+
+# Entries longer than this many (estimated) tokens are summarized in chunks
+# of LONG_INPUT_CHUNK_TOKENS, LONG_INPUT_PARALLELISM at a time, before prompting
+LONG_INPUT_THRESHOLD = int(os.environ.get('LONG_INPUT_THRESHOLD', '1500'))
+LONG_INPUT_CHUNK_TOKENS = int(os.environ.get('LONG_INPUT_CHUNK_TOKENS', '800'))
+LONG_INPUT_PARALLELISM = int(os.environ.get('LONG_INPUT_PARALLELISM', '4'))
+# Tokens reserved for the reply (including deepseek-r1's <think> block) when sizing num_ctx
+REPLY_TOKEN_BUDGET = int(os.environ.get('REPLY_TOKEN_BUDGET', '1024'))
+# Every prompt that fits gets MIN_NUM_CTX, so Ollama only reloads the model for long ones
+MIN_NUM_CTX = int(os.environ.get('MIN_NUM_CTX', '4096'))
+MAX_NUM_CTX = int(os.environ.get('MAX_NUM_CTX', '16384'))
+
+# Which model serves each task (analysis, advisor:<perspective>, recipient, combined,
+# summary, chat), with fallbacks and optional p95 targets; see model_router.py
+MODEL_ROUTES = os.environ.get('MODEL_ROUTES', '')
@@ -0,0 +1,167 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SharedState:
+    """Counters and expiring key/value entries shared by all worker processes.
+
+    Backed by a SQLite file in WAL mode so every gunicorn worker (and every
+    thread within one) sees the same values. Connections are opened per
+    thread and reopened after fork.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql, params=()):
+        """Run a single autocommitted statement and return the cursor"""
+        return self._connect().execute(sql, params)
+
+    def transaction(self):
+        """Context manager for an immediate (write-locked) transaction"""
+        return _Transaction(self._connect())
+
+    def incr(self, key, amount=1):
+        """Add ``amount`` to a counter and return the new value"""
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (key, amount)
+            )
+            return db.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+
+    def set_counter(self, key, value):
+        self._connect().execute(
+            "INSERT INTO counters (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def counter(self, key, default=0):
+        row = self._connect().execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def counters(self, prefix=''):
+        rows = self._connect().execute(
+            "SELECT key, value FROM counters WHERE key >= ? AND key < ? ORDER BY key",
+            (prefix, prefix + '\uffff')
+        ).fetchall()
+        return {key: value for key, value in rows}
+
+    def take(self, key):
+        """Atomically decrement a positive counter; True if one was taken"""
+        cursor = self._connect().execute(
+            "UPDATE counters SET value = value - 1 WHERE key = ? AND value > 0",
+            (key,)
+        )
+        return cursor.rowcount == 1
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connect().execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, json.dumps(value), expires_at)
+        )
+
+    def add(self, key, value, ttl=None):
+        """Set ``key`` only if it is absent or expired; True if this call set it"""
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self.transaction() as db:
+            db.execute("DELETE FROM kv WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?", (key, now))
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            return cursor.rowcount == 1
+
+    def get(self, key, default=None):
+        row = self._connect().execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return json.loads(row[0])
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        self._connect().execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+
+class CounterBuffer:
+    """Counter increments batched in this process and written to SharedState together.
+
+    Metrics are bumped on every request, and a write transaction on the
+    shared database each time would serialize all workers. Increments are
+    summed in memory and flushed at most every ``interval`` seconds (when
+    the next increment arrives, on ``flush()`` and at exit), so shared
+    totals lag by up to ``interval`` per worker.
+    """
+
+    def __init__(self, state, interval=5):
+        self.state = state
+        self.interval = interval
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's unflushed counts are the parent's to write
+                self.pending = {}
+                self._pid = os.getpid()
+            self.pending[key] = self.pending.get(key, 0) + amount
+            due = time.monotonic() - self.flushed_at >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+        if not pending:
+            return
+        with self.state.transaction() as db:
+            db.executemany(
+                "INSERT INTO counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                list(pending.items())
+            )
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
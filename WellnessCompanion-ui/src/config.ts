@@ -11,5 +11,10 @@ export const config = {
      * Change this to match your localhost service URL
      */
     baseUrl: 'http://localhost:5000',
+    /**
+     * Key sent as X-API-Key; identifies whose journal is synced and whose
+     * replies are pooled for degraded mode
+     */
+    apiKey: '',
   },
 }; 
\ No newline at end of file
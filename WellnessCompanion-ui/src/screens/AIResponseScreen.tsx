@@ -5,7 +5,8 @@ import { theme } from '../theme';
 import { NavigationParams, JournalEntry } from '../types';
 import { NativeStackNavigationProp } from '@react-navigation/native-stack';
 import { RouteProp } from '@react-navigation/native';
-import { apiService } from '../services/api';
+import { apiService, createIdempotencyKey } from '../services/api';
+import { config } from '../config';
 
 type Props = {
   navigation: NativeStackNavigationProp<NavigationParams, 'AIResponse'>;
@@ -72,6 +73,12 @@ export const AIResponseScreen: React.FC<Props> = ({ navigation, route }) => {
           emotionObject: JSON.stringify(journalEntry.emotion),
         });
         
+        // One key for this screen's request: if the direct call fails on the
+        // client while the server is still generating, the call below joins it
+        const requestKey = createIdempotencyKey();
+        // ...unless both features are selected, where the call below sends a different body
+        const retryKey = journalEntry.advisorPerspective && journalEntry.recipient ? createIdempotencyKey() : requestKey;
+        
         // Add basic fetch test to verify API is reachable
         try {
           console.log('AIResponseScreen: Testing direct API call');
@@ -79,6 +86,8 @@ export const AIResponseScreen: React.FC<Props> = ({ navigation, route }) => {
             method: 'POST',
             headers: {
               'Content-Type': 'application/json',
+              'X-API-Key': config.api.apiKey,
+              'Idempotency-Key': requestKey,
             },
             body: JSON.stringify({
               content: journalEntry.content,
@@ -115,7 +124,8 @@ export const AIResponseScreen: React.FC<Props> = ({ navigation, route }) => {
               journalEntry.content,
               journalEntry.emotion.name,
               journalEntry.advisorPerspective,
-              journalEntry.emotion.intensity
+              journalEntry.emotion.intensity,
+              retryKey
             );
             console.log('AIResponseScreen: Successfully received advice response:', response.substring(0, 100));
           } catch (adviceError) {
@@ -130,7 +140,8 @@ export const AIResponseScreen: React.FC<Props> = ({ navigation, route }) => {
               journalEntry.content,
               journalEntry.emotion.name,
               journalEntry.recipient,
-              journalEntry.emotion.intensity
+              journalEntry.emotion.intensity,
+              retryKey
             );
             console.log('AIResponseScreen: Successfully received formatting response:', response.substring(0, 100));
           } catch (formatError) {
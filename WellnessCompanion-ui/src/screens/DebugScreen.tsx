@@ -1,6 +1,7 @@
 import React, { useState } from 'react';
 import { View, Text, StyleSheet, ScrollView, SafeAreaView, TouchableOpacity, ActivityIndicator } from 'react-native';
 import { theme } from '../theme';
+import { config } from '../config';
 
 /**
  * Debug screen to test API connections directly
@@ -36,6 +37,7 @@ export const DebugScreen: React.FC = () => {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-API-Key': config.api.apiKey,
         },
         body: JSON.stringify(requestBody),
       });
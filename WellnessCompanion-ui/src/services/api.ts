@@ -4,6 +4,13 @@ import { config } from '../config';
 // Get the API base URL from the config
 const API_BASE_URL = config.api.baseUrl;
 
+/**
+ * Create a key for one logical LLM request. Sending it as Idempotency-Key on
+ * every attempt lets the server answer retries with the original generation.
+ */
+export const createIdempotencyKey = (): string =>
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+
 /**
  * Service to handle API calls to the local agent service
  */
@@ -51,6 +58,7 @@ Keep your response to 3-4 sentences, written in second person (addressing the wr
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-API-Key': config.api.apiKey,
         },
         body: JSON.stringify({
           message: `The user has written a journal entry about feeling ${emotion} with intensity level ${intensity || 3} (on a scale of 1-5). 
@@ -83,9 +91,16 @@ Provide an empathetic and insightful analysis of their emotions and thoughts. Fo
    * @param emotion The emotion name
    * @param advisorPerspective The selected advisor perspective (therapist, friend, etc)
    * @param intensity Optional intensity level (1-5)
+   * @param idempotencyKey Key shared by all attempts of this request
    * @returns Promise with the AI advice response
    */
-  getAdvice: async (content: string, emotion: string, advisorPerspective: string, intensity?: number): Promise<string> => {
+  getAdvice: async (
+    content: string,
+    emotion: string,
+    advisorPerspective: string,
+    intensity?: number,
+    idempotencyKey: string = createIdempotencyKey()
+  ): Promise<string> => {
     try {
       console.log('Sending advice request:', { 
         content: content.substring(0, 50), 
@@ -99,6 +114,8 @@ Provide an empathetic and insightful analysis of their emotions and thoughts. Fo
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-API-Key': config.api.apiKey,
+          'Idempotency-Key': idempotencyKey,
         },
         body: JSON.stringify({
           content,
@@ -122,10 +139,13 @@ Provide an empathetic and insightful analysis of their emotions and thoughts. Fo
       // Try direct fetch as fallback
       try {
         console.log('Trying direct fetch fallback for advice');
+        // Same key: if the first attempt is still generating, this joins it
         const fallbackResponse = await fetch(`${API_BASE_URL}/api/respond`, {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
+            'X-API-Key': config.api.apiKey,
+            'Idempotency-Key': idempotencyKey,
           },
           body: JSON.stringify({
             content,
@@ -153,9 +173,16 @@ Provide an empathetic and insightful analysis of their emotions and thoughts. Fo
    * @param emotion The emotion name
    * @param recipient The intended recipient (self, friend, partner, family)
    * @param intensity Optional intensity level (1-5)
+   * @param idempotencyKey Key shared by all attempts of this request
    * @returns Promise with the formatted sharing text
    */
-  formatForSharing: async (content: string, emotion: string, recipient: string, intensity?: number): Promise<string> => {
+  formatForSharing: async (
+    content: string,
+    emotion: string,
+    recipient: string,
+    intensity?: number,
+    idempotencyKey: string = createIdempotencyKey()
+  ): Promise<string> => {
     try {
       console.log('Sending sharing format request:', { 
         content: content.substring(0, 50), 
@@ -169,6 +196,8 @@ Provide an empathetic and insightful analysis of their emotions and thoughts. Fo
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-API-Key': config.api.apiKey,
+          'Idempotency-Key': idempotencyKey,
         },
         body: JSON.stringify({
           content,
@@ -192,10 +221,13 @@ Provide an empathetic and insightful analysis of their emotions and thoughts. Fo
       // Try direct fetch as fallback
       try {
         console.log('Trying direct fetch fallback for sharing');
+        // Same key: if the first attempt is still generating, this joins it
         const fallbackResponse = await fetch(`${API_BASE_URL}/api/respond`, {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
+            'X-API-Key': config.api.apiKey,
+            'Idempotency-Key': idempotencyKey,
           },
           body: JSON.stringify({
             content,
@@ -247,4 +279,66 @@ Provide an empathetic and insightful analysis of their emotions and thoughts. Fo
       throw error;
     }
   },
+
+  /**
+   * Get journal entries saved or deleted on the server since the last sync
+   * @param cursor The cursor returned by the previous sync (0 for everything)
+   * @returns Promise with the changes, the new cursor and whether more pages follow
+   */
+  getChanges: async (cursor: number): Promise<{
+    changes: { cursor: number; op: 'upsert' | 'delete'; id: string; entry?: JournalEntry }[];
+    cursor: number;
+    has_more: boolean;
+  }> => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/sync?cursor=${cursor}`, {
+        headers: {
+          'X-API-Key': config.api.apiKey,
+        },
+      });
+
+      if (!response.ok) {
+        console.error(`API error: ${response.status}`, await response.text());
+        throw new Error(`API error: ${response.status}`);
+      }
+
+      return await response.json();
+    } catch (error) {
+      console.error('Error getting changes:', error);
+      throw error;
+    }
+  },
+
+  /**
+   * Upload entries written or deleted while offline in a single request
+   * @param entries New or edited journal entries
+   * @param deletedIds Ids of entries deleted on this device
+   * @returns Promise with how many entries were saved and deleted. Keep pulling
+   * changes with getChanges from the stored cursor; the upload does not advance it.
+   */
+  uploadEntries: async (
+    entries: JournalEntry[],
+    deletedIds: string[] = []
+  ): Promise<{ saved: number; deleted: number }> => {
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/sync/entries`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'X-API-Key': config.api.apiKey,
+        },
+        body: JSON.stringify({ entries, deleted: deletedIds }),
+      });
+
+      if (!response.ok) {
+        console.error(`API error: ${response.status}`, await response.text());
+        throw new Error(`API error: ${response.status}`);
+      }
+
+      return await response.json();
+    } catch (error) {
+      console.error('Error uploading entries:', error);
+      throw error;
+    }
+  },
 }; 
\ No newline at end of file
@@ -0,0 +1,199 @@
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+logger = logging.getLogger(__name__)
+
+# Ollama reports these durations in nanoseconds on every non-streaming response
+OLLAMA_PHASES = (
+    ('load_duration', 'model_load'),
+    ('prompt_eval_duration', 'prompt_eval'),
+    ('eval_duration', 'generation'),
+)
+
+
+class Trace:
+    """Phase durations collected while handling one request"""
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, name, duration_ms, desc=None):
+        self.spans.append((name, duration_ms, desc))
+
+    def server_timing(self):
+        """Render the spans as a Server-Timing header value"""
+        entries = []
+        for name, duration_ms, desc in self.spans:
+            entry = f"{name};dur={duration_ms:.1f}"
+            if desc:
+                entry += f';desc="{desc}"'
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+def current_trace():
+    if not has_request_context():
+        return None
+    trace = getattr(g, 'trace', None)
+    if trace is None:
+        trace = g.trace = Trace()
+    return trace
+
+
+@contextmanager
+def span(name, desc=None):
+    """Time the enclosed block and record it on the current request's trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = current_trace()
+        if trace is not None:
+            trace.add(name, (time.perf_counter() - start) * 1000, desc)
+
+
+def record_span(name, started, desc=None):
+    """Record a phase that began at ``started`` (a perf_counter value) and ends now"""
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, (time.perf_counter() - started) * 1000, desc)
+
+
+def record_ollama_timings(response, wall_ms):
+    """Split an Ollama call into queue wait, model load, prompt eval and generation"""
+    trace = current_trace()
+    if trace is None:
+        return
+    total_ns = response.get('total_duration') or 0
+    for field, name in OLLAMA_PHASES:
+        value = response.get(field)
+        if value:
+            trace.add(name, value / 1e6)
+    if total_ns:
+        # Time spent waiting on Ollama before it started on our request
+        trace.add('upstream_wait', max(wall_ms - total_ns / 1e6, 0.0))
+
+
+class SamplingProfile:
+    """Samples one thread's stack at a fixed interval.
+
+    Output is in collapsed-stack format (``frame;frame;frame count``), which
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """Profiles the next N requests when armed through the admin endpoint.
+
+    The remaining count lives in SharedState so that arming the profiler
+    through one worker process applies to requests served by any worker.
+    """
+
+    MODES = ('cprofile', 'sampling')
+
+    def __init__(self, output_dir, state):
+        self.output_dir = output_dir
+        self.state = state
+
+    def arm(self, requests, mode='cprofile', interval=0.005):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {', '.join(self.MODES)}")
+        self.state.set('profiler', {'mode': mode, 'interval': float(interval)})
+        self.state.set_counter('profiler:remaining', int(requests))
+
+    def recent_dumps(self, limit=10):
+        if not os.path.isdir(self.output_dir):
+            return []
+        names = sorted(os.listdir(self.output_dir), reverse=True)[:limit]
+        return [os.path.join(self.output_dir, name) for name in names]
+
+    def status(self):
+        settings = self.state.get('profiler', {'mode': 'cprofile', 'interval': 0.005})
+        return {
+            'remaining': int(self.state.counter('profiler:remaining')),
+            'mode': settings['mode'],
+            'output_dir': os.path.abspath(self.output_dir),
+            'recent_dumps': self.recent_dumps()
+        }
+
+    def _claim(self):
+        # Cheap read first so unarmed requests never take the write lock
+        if self.state.counter('profiler:remaining') <= 0:
+            return None
+        if not self.state.take('profiler:remaining'):
+            return None
+        return self.state.get('profiler', {'mode': 'cprofile', 'interval': 0.005})
+
+    def start(self):
+        """Start profiling the current request if the profiler is armed"""
+        settings = self._claim()
+        if settings is None:
+            return None
+        if settings['mode'] == 'sampling':
+            profile = SamplingProfile(threading.get_ident(), settings['interval'])
+            profile.start()
+            return profile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already attached to this thread
+            return None
+        return profile
+
+    def finish(self, profile, path):
+        if isinstance(profile, SamplingProfile):
+            profile.stop()
+            suffix = 'folded'
+        else:
+            profile.disable()
+            suffix = 'prof'
+        os.makedirs(self.output_dir, exist_ok=True)
+        route = ''.join(char if char.isalnum() else '_' for char in path.strip('/'))[:64] or 'root'
+        # Named from a server-side token, never from client-supplied text
+        filename = os.path.join(self.output_dir, f"{int(time.time())}-{route}-{uuid.uuid4().hex[:16]}.{suffix}")
+        if suffix == 'folded':
+            profile.dump(filename)
+        else:
+            profile.dump_stats(filename)
+        logger.info("Wrote request profile", extra={'path': path, 'file': filename})
+        return filename
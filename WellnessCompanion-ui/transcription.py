@@ -0,0 +1,252 @@
+import importlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class RecordingNotFound(Exception):
+    """Raised for unknown, finished or expired voice recordings"""
+
+
+class SpeechToTextEngine:
+    """Interface for local speech-to-text engines.
+
+    ``transcribe`` receives the bytes of one independently decodable audio
+    segment (e.g. a short m4a/webm/wav file recorded by the app) and returns
+    its text. ``prompt`` is the tail of the transcript so far, which engines
+    can use to keep spelling and punctuation consistent across segments.
+    """
+
+    def transcribe(self, audio, mime_type=None, prompt=None):
+        raise NotImplementedError
+
+
+class FakeEngine(SpeechToTextEngine):
+    """Stand-in engine for tests and development without a speech model.
+
+    Uploaded bytes that decode as UTF-8 are treated as the spoken text, so a
+    client or script can "record" by sending text chunks.
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def transcribe(self, audio, mime_type=None, prompt=None):
+        if self.delay:
+            time.sleep(self.delay)
+        try:
+            return audio.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            return f"[{len(audio)} bytes of audio]"
+
+
+class WhisperEngine(SpeechToTextEngine):
+    """Local Whisper transcription via faster-whisper (CTranslate2).
+
+    The model is loaded on first use so worker start-up stays fast.
+    CTranslate2 releases the GIL while decoding, so several segments can be
+    transcribed at once from a thread pool.
+    """
+
+    def __init__(self, model='base.en', device='cpu', compute_type='int8', language=None):
+        self.model_name = model
+        self.device = device
+        self.compute_type = compute_type
+        self.language = language
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from faster_whisper import WhisperModel
+                    except ImportError:
+                        raise RuntimeError("STT_ENGINE=whisper needs the faster-whisper package (pip install faster-whisper)")
+                    self._model = WhisperModel(self.model_name, device=self.device, compute_type=self.compute_type)
+        return self._model
+
+    def transcribe(self, audio, mime_type=None, prompt=None):
+        import io
+        segments, _ = self._load().transcribe(
+            io.BytesIO(audio),
+            language=self.language,
+            initial_prompt=prompt,
+            vad_filter=True
+        )
+        return ' '.join(segment.text.strip() for segment in segments).strip()
+
+
+ENGINES = {
+    'fake': FakeEngine,
+    'whisper': WhisperEngine,
+}
+
+
+def load_engine(name, **options):
+    """Create an engine by registered name or as ``package.module:ClassName``"""
+    if ':' in name:
+        module_name, class_name = name.split(':', 1)
+        engine_class = getattr(importlib.import_module(module_name), class_name)
+    elif name in ENGINES:
+        engine_class = ENGINES[name]
+    else:
+        raise ValueError(f"Unknown speech-to-text engine '{name}'; use one of {sorted(ENGINES)} or module:Class")
+    return engine_class(**options)
+
+
+class VoiceTranscriber:
+    """Incremental transcription of voice notes uploaded in chunks.
+
+    The app uploads each recorded segment as soon as it is captured and it is
+    transcribed on a background thread while recording continues, so when
+    the user stops only the last segment is left to transcribe. Segment
+    transcripts live in SharedState, so chunks of one recording can land on
+    different worker processes.
+
+    Segment statuses are 'pending', 'done' or 'error'; a failed segment is
+    left out of the transcript rather than failing the whole note.
+    """
+
+    def __init__(self, state, engine, workers=2, recording_ttl=3600, prompt_chars=200):
+        self.state = state
+        self.engine = engine
+        self.recording_ttl = recording_ttl
+        self.prompt_chars = prompt_chars
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stt')
+        with self.state.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS voice_recordings "
+                "(id TEXT PRIMARY KEY, created_at REAL NOT NULL, finished INTEGER NOT NULL DEFAULT 0)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS voice_segments "
+                "(recording_id TEXT NOT NULL, seq INTEGER NOT NULL, status TEXT NOT NULL, "
+                "text TEXT, updated_at REAL NOT NULL, PRIMARY KEY (recording_id, seq))"
+            )
+
+    def start(self):
+        """Open a new recording and return its id"""
+        recording_id = uuid.uuid4().hex
+        now = time.time()
+        with self.state.transaction() as db:
+            expired = now - self.recording_ttl
+            db.execute(
+                "DELETE FROM voice_segments WHERE recording_id IN "
+                "(SELECT id FROM voice_recordings WHERE created_at <= ?)",
+                (expired,)
+            )
+            db.execute("DELETE FROM voice_recordings WHERE created_at <= ?", (expired,))
+            db.execute("INSERT INTO voice_recordings (id, created_at) VALUES (?, ?)", (recording_id, now))
+        return recording_id
+
+    def _check_open(self, db, recording_id):
+        row = db.execute(
+            "SELECT created_at, finished FROM voice_recordings WHERE id = ?", (recording_id,)
+        ).fetchone()
+        if row is None or row[1] or row[0] <= time.time() - self.recording_ttl:
+            raise RecordingNotFound(recording_id)
+
+    def add_chunk(self, recording_id, seq, audio, mime_type=None):
+        """Queue one segment for transcription; re-uploading a seq replaces it"""
+        with self.state.transaction() as db:
+            self._check_open(db, recording_id)
+            db.execute(
+                "INSERT OR REPLACE INTO voice_segments (recording_id, seq, status, text, updated_at) "
+                "VALUES (?, ?, 'pending', NULL, ?)",
+                (recording_id, seq, time.time())
+            )
+        self.pool.submit(self._transcribe, recording_id, seq, audio, mime_type)
+
+    def _prompt_for(self, recording_id, seq):
+        """Tail of the previous segment's text, if it is already transcribed"""
+        row = self.state.execute(
+            "SELECT text FROM voice_segments WHERE recording_id = ? AND seq = ? AND status = 'done'",
+            (recording_id, seq - 1)
+        ).fetchone()
+        return row[0][-self.prompt_chars:] if row and row[0] else None
+
+    def _transcribe(self, recording_id, seq, audio, mime_type):
+        started = time.perf_counter()
+        try:
+            text = self.engine.transcribe(audio, mime_type, self._prompt_for(recording_id, seq))
+            status = 'done'
+        except Exception as e:
+            logger.warning("Transcribing voice segment failed: %s", e, extra={
+                'recording_id': recording_id,
+                'seq': seq
+            })
+            text, status = None, 'error'
+        with self.state.transaction() as db:
+            db.execute(
+                "UPDATE voice_segments SET status = ?, text = ?, updated_at = ? "
+                "WHERE recording_id = ? AND seq = ?",
+                (status, text, time.time(), recording_id, seq)
+            )
+        logger.debug("Voice segment transcribed", extra={
+            'recording_id': recording_id,
+            'seq': seq,
+            'audio_bytes': len(audio),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+        })
+
+    def _segments(self, recording_id):
+        return self.state.execute(
+            "SELECT seq, status, text FROM voice_segments WHERE recording_id = ? ORDER BY seq",
+            (recording_id,)
+        ).fetchall()
+
+    @staticmethod
+    def _join(segments):
+        return ' '.join(text for _, status, text in segments if status == 'done' and text)
+
+    def progress(self, recording_id):
+        """Transcript of the segments finished so far"""
+        with self.state.transaction() as db:
+            self._check_open(db, recording_id)
+        segments = self._segments(recording_id)
+        return {
+            'recording_id': recording_id,
+            'transcript': self._join(segments),
+            'segments': len(segments),
+            'pending': sum(1 for _, status, _ in segments if status == 'pending'),
+            'failed': [seq for seq, status, _ in segments if status == 'error']
+        }
+
+    def finish(self, recording_id, expected_chunks=None, timeout=60.0, poll_interval=0.05):
+        """Wait for outstanding segments and return the assembled transcript.
+
+        ``expected_chunks`` is the number of segments the client sent, so a
+        final chunk still in transit to another worker is waited for too.
+        Whatever is done when ``timeout`` expires is returned with
+        ``complete`` set to False.
+        """
+        with self.state.transaction() as db:
+            self._check_open(db, recording_id)
+        deadline = time.monotonic() + timeout
+        while True:
+            segments = self._segments(recording_id)
+            pending = sum(1 for _, status, _ in segments if status == 'pending')
+            missing = max((expected_chunks or 0) - len(segments), 0)
+            if not pending and not missing:
+                complete = True
+                break
+            if time.monotonic() >= deadline:
+                complete = False
+                break
+            time.sleep(poll_interval)
+
+        with self.state.transaction() as db:
+            db.execute("UPDATE voice_recordings SET finished = 1 WHERE id = ?", (recording_id,))
+        return {
+            'recording_id': recording_id,
+            'transcript': self._join(segments),
+            'segments': len(segments),
+            'failed': [seq for seq, status, _ in segments if status == 'error'],
+            'complete': complete
+        }